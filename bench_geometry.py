@@ -0,0 +1,55 @@
+import numpy as np
+import time
+import argparse
+from ins_tools.geometry_helpers import quat2mat, quat2euler, euler2quat, mat2euler, quat2mat_batch, quat2euler_batch, euler2quat_batch, mat2euler_batch
+
+def best_time(fn, repeats):
+    """
+    Runs a function several times and returns the fastest wall time.
+
+    :param fn: Function without arguments to time
+    :param repeats: Number of runs
+
+    :returns: Fastest run time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    # Micro-benchmark of the batched geometry conversions against the per-attitude functions
+    parser = argparse.ArgumentParser(description="Compares the batched geometry conversions with looping over the scalar functions.")
+    parser.add_argument("--n", type=int, default=10000, help="Number of attitudes converted per call")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of timed runs, the fastest is reported")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    angles = rng.uniform(-np.pi, np.pi, (args.n, 3))
+    angles[:, 1] /= 2 # pitch within +-90 degrees
+    quats = euler2quat_batch(angles)
+    mats = quat2mat_batch(quats)
+    # Preallocated output buffers
+    mat_out = np.empty((args.n, 3, 3))
+    euler_out = np.empty((args.n, 3))
+    quat_out = np.empty((args.n, 4))
+
+    cases = [
+        ('quat2mat', lambda: [quat2mat(q) for q in quats], lambda: quat2mat_batch(quats, out=mat_out)),
+        ('mat2euler', lambda: [mat2euler(m, 'sxyz') for m in mats], lambda: mat2euler_batch(mats, 'sxyz', out=euler_out)),
+        ('quat2euler', lambda: [quat2euler(q, 'sxyz') for q in quats], lambda: quat2euler_batch(quats, 'sxyz', out=euler_out)),
+        ('euler2quat', lambda: [euler2quat(*a, 'sxyz') for a in angles], lambda: euler2quat_batch(angles, 'sxyz', out=quat_out)),
+    ]
+
+    print(f"N = {args.n}")
+    for name, scalar, batch in cases:
+        # Batched results must agree with the scalar functions
+        diff = np.max(np.abs(np.array(scalar()) - batch()))
+        t_scalar = best_time(scalar, args.repeats)
+        t_batch = best_time(batch, args.repeats)
+        print(f"{name}: scalar {t_scalar*1e3:.2f} ms, batched {t_batch*1e3:.3f} ms, speedup {t_scalar/t_batch:.0f}x, max difference {diff:.1e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import numpy as np
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from ins_tools.INS_realtime import INS
+from ins_tools.geometry_helpers import quat2mat, quat2euler, mat2euler, euler2quat, quat2mat_batch, quat2euler_batch, mat2euler_batch, euler2quat_batch
+from ins_tools.storage import load_imu, list_tables, window_size
+from bench_geometry import best_time
+
+# Recordings benchmarked end to end, one per condition by default
+TRIALS = {
+    'walk': ('data/hallway/walk', ''),
+    'run': ('data/hallway/run', ''),
+    'mixed': ('data/hallway/mixed', ''),
+    '1F': ('data/stairs', '-1F'),
+    '2F': ('data/stairs', '-2F'),
+    '3F': ('data/stairs', '-3F'),
+}
+# Recording the micro-benchmarks run on
+MICRO_FILE = 'data/hallway/walk/trial1.csv'
+# The detector window is given by window_size() for the sampling rate of each recording
+PARAMS = {'sigma_a': 0.00098, 'sigma_w': 9.20E-05, 'threshold': 2.20E+08}
+
+def trial_files(all_trials):
+    """
+    Lists the recordings benchmarked end to end.
+
+    :param all_trials: Every recording of each condition instead of only the first one
+
+    :returns: List of (condition, file path) tuples
+    """
+    files = []
+    for condition, (directory, suffix) in TRIALS.items():
+        names = [name for name in list_tables(directory) if 'trial' in name and name.endswith(suffix + '.csv')]
+        if not all_trials:
+            names = names[:1]
+        files.extend((condition, os.path.join(directory, name)) for name in names)
+    return files
+
+def per_call(fn, calls, repeats):
+    """Fastest time of a function running calls calls, per call in seconds."""
+    return best_time(fn, repeats)/calls
+
+def micro_benchmarks(repeats, samples):
+    """
+    Times the INS hot paths on a slice of a recording.
+
+    :param repeats: Number of timed runs, the fastest is reported
+    :param samples: Number of samples each per-sample function is called on
+
+    :returns: Dictionary of benchmark names to seconds per call
+    """
+    imu, T = load_imu(MICRO_FILE)
+    W = window_size(T)
+    ins = INS(imu, sigma_a = PARAMS['sigma_a'], sigma_w = PARAMS['sigma_w'], T = T)
+    loc = ins.Localizer
+    zv = loc.compute_zv_lrt(imu, W=W, G=PARAMS['threshold'])
+    # States and quaternions along the recording to call the per-sample functions with
+    ins.baseline(imudata=imu, zv=zv, init=True)
+    xs, qs = ins.x_check[:samples].copy(), ins.q[:samples].copy()
+    imus = imu[:samples]
+    dt = ins.T
+    rots = [quat2mat(q) for q in qs]
+    P = loc.P.copy()
+    P_work = np.empty((9,9))
+    f_n = [rot.dot(s[0:3]) for rot, s in zip(rots, imus)]
+
+    def corrector():
+        for x, rot, q in zip(xs, rots, qs):
+            P_work[:] = P
+            loc.corrector(x.copy(), P_work, rot, q)
+
+    def propagate_cov():
+        for f in f_n:
+            loc.propagate_cov(P, f, dt, P_work)
+
+    def baseline(backend):
+        def run():
+            ins = INS(imu, sigma_a = PARAMS['sigma_a'], sigma_w = PARAMS['sigma_w'], T = T, backend = backend, cov_history = 'latest')
+            ins.baseline(imudata=imu, zv=zv, init=True)
+        return run
+
+    angles = np.array([quat2euler(q, 'sxyz') for q in qs])
+    results = {
+        'micro/SHOE': per_call(lambda: loc.SHOE(imu, W=W), 1, repeats),
+        'micro/nav_eq': per_call(lambda: [loc.nav_eq(x, s, q, dt) for x, s, q in zip(xs, imus, qs)], samples, repeats),
+        'micro/state_update': per_call(lambda: [loc.state_update(s, q, dt) for s, q in zip(imus, qs)], samples, repeats),
+        'micro/propagate_cov': per_call(propagate_cov, samples, repeats),
+        'micro/corrector': per_call(corrector, samples, repeats),
+        'micro/baseline_default': per_call(baseline('default'), len(imu), repeats),
+        'micro/baseline_fast': per_call(baseline('fast'), len(imu), repeats),
+        'micro/quat2mat': per_call(lambda: [quat2mat(q) for q in qs], samples, repeats),
+        'micro/quat2euler': per_call(lambda: [quat2euler(q, 'sxyz') for q in qs], samples, repeats),
+        'micro/mat2euler': per_call(lambda: [mat2euler(rot, 'sxyz') for rot in rots], samples, repeats),
+        'micro/euler2quat': per_call(lambda: [euler2quat(*a, 'sxyz') for a in angles], samples, repeats),
+        'micro/quat2mat_batch': per_call(lambda: quat2mat_batch(qs), samples, repeats),
+        'micro/quat2euler_batch': per_call(lambda: quat2euler_batch(qs), samples, repeats),
+        'micro/mat2euler_batch': per_call(lambda: mat2euler_batch(np.array(rots)), samples, repeats),
+        'micro/euler2quat_batch': per_call(lambda: euler2quat_batch(angles), samples, repeats),
+    }
+    return results
+
+def end_to_end(repeats, all_trials, backends):
+    """
+    Times the full estimates (zero-velocity detection and INS) of the bundled recordings.
+
+    :param repeats: Number of timed runs, the fastest is reported
+    :param all_trials: Every recording of each condition instead of only the first one
+    :param backends: Localizer backends to time
+
+    :returns: Dictionary of benchmark names to seconds per recording
+    """
+    results = {}
+    for condition, path in trial_files(all_trials):
+        imu, T = load_imu(path)
+        for backend in backends:
+            def run():
+                ins = INS(imu, sigma_a = PARAMS['sigma_a'], sigma_w = PARAMS['sigma_w'], T = T, backend = backend, cov_history = 'latest')
+                zv = ins.Localizer.compute_zv_lrt(imu, W=window_size(T), G=PARAMS['threshold'])
+                ins.baseline(imudata=imu, zv=zv, init=True)
+            results[f'e2e/{condition}/{os.path.basename(path)}/{backend}'] = best_time(run, repeats)
+    return results
+
+def git_commit():
+    """Returns the current git commit, or None outside a git repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_time(seconds):
+    """Formats a time in the most readable unit."""
+    return f"{seconds*1e3:.2f} ms" if seconds >= 1e-3 else f"{seconds*1e6:.2f} us"
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a baseline run.
+
+    :param results: Dictionary of benchmark names to seconds
+    :param baseline: Dictionary of benchmark names to seconds of the baseline run
+    :param threshold: Slowdown in percent above which a benchmark counts as a regression
+
+    :returns: List of (name, baseline seconds, seconds, change in percent) tuples of the regressions
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = (seconds/baseline[name] - 1)*100
+        flag = ''
+        if change > threshold:
+            regressions.append((name, baseline[name], seconds, change))
+            flag = '  REGRESSION'
+        print(f"{name}: {format_time(baseline[name])} -> {format_time(seconds)} ({change:+.1f}%){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the INS hot paths and the full estimates of the bundled recordings, and flags regressions against a saved baseline.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of timed runs, the fastest is reported")
+    parser.add_argument("--samples", type=int, default=500, help="Number of samples the per-sample micro-benchmarks run on")
+    parser.add_argument("--all-trials", action="store_true", help="Benchmarks every recording end to end instead of one per condition")
+    parser.add_argument("--backends", nargs="+", default=["default", "fast"], choices=["default", "fast"], help="Localizer backends benchmarked end to end")
+    parser.add_argument("--skip-micro", action="store_true", help="Skips the micro-benchmarks")
+    parser.add_argument("--skip-e2e", action="store_true", help="Skips the end-to-end benchmarks")
+    parser.add_argument("--history", default="results/benchmarks/history.json", help="JSON file the results are appended to")
+    parser.add_argument("--baseline", default="results/benchmarks/baseline.json", help="JSON file of the baseline results")
+    parser.add_argument("--save-baseline", action="store_true", help="Saves these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=10, help="Slowdown in percent against the baseline counted as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    if not args.skip_micro:
+        results.update(micro_benchmarks(args.repeats, args.samples))
+    if not args.skip_e2e:
+        results.update(end_to_end(args.repeats, args.all_trials, args.backends))
+
+    run = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.node(),
+        'repeats': args.repeats,
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    history.append(run)
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=2)
+    print(f"Results appended to: {args.history}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Compared with baseline from commit {baseline['commit']} ({baseline['time']}):")
+        regressions = compare(results, baseline['results'], args.threshold)
+    else:
+        for name, seconds in results.items():
+            print(f"{name}: {format_time(seconds)}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to: {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:g}%")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
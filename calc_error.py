@@ -1,100 +1,259 @@
 import numpy as np
 import os
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 from ins_tools.INS_realtime import INS
+from ins_tools.INS_batch import BatchINS
+from ins_tools.storage import load_table, load_imu, list_tables, binary_path, window_size
 import math
 
+# Parameters of the INS and zero-velocity detector used for the full estimates, the detector window is
+# given by window_size() for the sampling rate of each recording
+PARAMS = {'sigma_a': 0.00098, 'sigma_w': 9.20E-05, 'threshold': 2.20E+08, 'g': 9.8029}
+# Bumped when the way the full estimates are calculated changes, invalidating cached results
+CACHE_VERSION = 1
+
 def calc_dist(x):
     return np.linalg.norm(x) # 2d
 
-estimates = 'results/estimates'
-
-# Distances travelled for the different conditions
-dists = {'walk':42.8, 'run':42.8, 'mixed':42.8, '1F':9.1, '2F':24.95, '3F':40.8}
-total = {'walk':[], 'run':[], 'mixed':[], '1F':[], '2F':[], '3F':[]}
-# Real-time estimates
-for filename in sorted(os.listdir(estimates)):
-    if ("walk_trial" in filename or "run_trial" in filename or "mixed_trial" in filename) and filename.endswith(".csv"): 
-        file_path = os.path.join(estimates, filename)
-        data = np.loadtxt(file_path, delimiter=",", skiprows=1)
-        
-        # XY Plane
-        last_values = data[-1, :2]
-        if "walk_trial" in filename:
-            total['walk'].append(calc_dist(last_values))
-        elif "run_trial" in filename:
-            total['run'].append(calc_dist(last_values))
-        else:
-            total['mixed'].append(calc_dist(last_values))
-        
-        #print(f"File: {filename}, XY distance: {calc_dist(last_values)}")
-
-    if ("stairs_trial" in filename) and filename.endswith(".csv"):
-        file_path = os.path.join(estimates, filename)
-        data = np.loadtxt(file_path, delimiter=",", skiprows=1)
-        
-        # XYZ Space
-        last_values = data[-1, :3]
-        if "1F" in filename:
-            total['1F'].append(calc_dist(last_values))
-        elif "2F" in filename:
-            total['2F'].append(calc_dist(last_values))
-        else:
-            total['3F'].append(calc_dist(last_values))
-        
-        #print(f"File: {filename}, XYZ distance: {calc_dist(last_values)}")
-
-print (total)
-for x in total:
-    mean = sum(total[x]) / 9
-    # Average loop closure error
-    print (x + ' position error: ' + str(round(mean,4)) + 'm')
-    # Average relative error
-    print (x + ' relative error: ' + str(round((mean/dists[x])*100, 4)) + '%')
-    # Standard deviation
-    print (x + ' sd: ' + str(round(math.sqrt(sum((val - mean) ** 2 for val in total[x]) / (len(total[x]) - 1)),4)))
-
 def full_estimates(trial_type, trial_speed, file_name):
     """
-    Loads IMU data from a raw IMU data CSV file and initialises the INS to process the data all at once.
+    Loads IMU data from a raw IMU data CSV file and initialises the INS to process the data all at once,
+    with the recorded time step of each sample if there are any.
 
     :param trial_type: Type of trial (hallway or stairs)
     :param trial_speed: Movement speed (walk, run, or mixed)
     :param file_name: IMU data file name
 
-    :returns: 
+    :returns:
         - **x** (*ndarray*) – Array of estimated states from the INS
     :rtype: ndarray
     """
-    imu = np.loadtxt(os.path.join('data',trial_type,trial_speed,file_name), delimiter=",", skiprows=1)
-    ins = INS(imu, sigma_a = 0.00098, sigma_w = 9.20E-05)
-    zv = ins.Localizer.compute_zv_lrt(imu, W=5, G=2.20E+08)
+    imu, T = load_imu(os.path.join('data',trial_type,trial_speed,file_name))
+    ins = INS(imu, sigma_a = PARAMS['sigma_a'], sigma_w = PARAMS['sigma_w'], T = T, g = PARAMS['g'], cov_history = 'latest')
+    zv = ins.Localizer.compute_zv_lrt(imu, W=window_size(T), G=PARAMS['threshold'])
     x = ins.baseline(imudata=imu, zv=zv, init=True)
 
     return x
 
-total_full = {'walk':[], 'run':[], 'mixed':[], '1F':[], '2F':[], '3F':[]}
-dirs = ['walk', 'run', 'mixed', 'stairs']
-for d in dirs:
-    if d == 'stairs':
-        full = 'data/'+d
-        for filename in sorted(os.listdir(full)):
-            if ('trial' in filename) and filename.endswith(".csv"): 
-                if "1F" in filename:
-                    total_full['1F'].append(calc_dist(full_estimates('stairs', '', filename)[-1,:3]))
-                elif "2F" in filename:
-                    total_full['2F'].append(calc_dist(full_estimates('stairs', '', filename)[-1,:3]))
-                else:
-                    total_full['3F'].append(calc_dist(full_estimates('stairs', '', filename)[-1,:3]))
-    else:
-        full = 'data/hallway/'+d
-        for filename in sorted(os.listdir(full)):
-            if ('trial' in filename) and filename.endswith(".csv"): 
-                total_full[d].append(calc_dist(full_estimates('hallway', d, filename)[-1,:2]))
-
-print (total_full)
-for x in total_full:
-    mean = sum(total_full[x]) / 9
-    print (x + ' full position error: ' + str(round(mean,4)) + 'm')
-    print (x + ' full relative error: ' + str(round((mean/dists[x])*100, 4)) + '%')
-    print (x + ' sd: ' + str(round(math.sqrt(sum((val - mean) ** 2 for val in total[x]) / (len(total[x]) - 1)),4)))
+def full_estimates_batch(trials):
+    """
+    Loads IMU data from several raw IMU data CSV files and processes them all together in lockstep with BatchINS.
+    BatchINS has a single fixed sampling period, so recordings with time steps are processed one at a time.
+
+    :param trials: List of (trial type, trial speed, IMU data file name) tuples
+
+    :returns: List of arrays of estimated states from the INS, one per trial
+    """
+    imus = [load_table(os.path.join('data',trial_type,trial_speed,file_name)) for trial_type, trial_speed, file_name in trials]
+    timed = [imu.shape[1] > 6 for imu in imus]
+    results = [full_estimates(*trial) if t else None for trial, t in zip(trials, timed)]
+    untimed = [i for i, t in enumerate(timed) if not t]
+    if untimed:
+        ins = BatchINS([imus[i] for i in untimed], sigma_a = PARAMS['sigma_a'], sigma_w = PARAMS['sigma_w'], g = PARAMS['g'])
+        zv = ins.compute_zv_lrt(W=window_size(ins.T), G=PARAMS['threshold'])
+        for i, x in zip(untimed, ins.baseline(zv)):
+            results[i] = x
+    return results
+
+class EstimateCache:
+    """
+    On-disk cache of full estimates, keyed by the content of the raw IMU data CSV file and the INS and
+    zero-velocity detector parameters. Keeps its total size under a limit by evicting the least
+    recently used results.
+
+    :param directory: Directory the cached estimates are stored in
+    :param max_bytes: Maximum total size of the cached estimates in bytes
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_path):
+        """
+        Returns the cache key of a raw IMU data file for the current parameters.
+
+        :param file_path: Path of the raw IMU data CSV file, its binary copy is hashed if there is no CSV file
+        """
+        digest = hashlib.sha256()
+        if not os.path.exists(file_path):
+            file_path = binary_path(file_path)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(json.dumps({'params': PARAMS, 'version': CACHE_VERSION}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """Returns the path of the cached estimates for a key."""
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, key):
+        """
+        Returns the cached estimates for a key, or None if they are not cached.
+
+        :param key: Cache key from key()
+        """
+        path = self.path(key)
+        try:
+            x = np.load(path)
+        except (OSError, ValueError):
+            return None
+        os.utime(path) # Marks as recently used
+        return x
+
+    def store(self, key, x):
+        """
+        Stores the estimates for a key and evicts the least recently used results over the size limit.
+
+        :param key: Cache key from key()
+        :param x: Array of estimated states
+        """
+        # Written under a temporary name first so an interrupted run never leaves a partial file
+        tmp = self.path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, x)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used results until the cache fits in its size limit."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_size -= size
+
+def realtime_errors(estimates):
+    """
+    Calculates the loop closure distances of the real-time estimates recorded during the trials.
+
+    :param estimates: Directory of the real-time estimate CSV files
+
+    :returns: Dictionary of loop closure distances per condition
+    """
+    total = {'walk':[], 'run':[], 'mixed':[], '1F':[], '2F':[], '3F':[]}
+    for filename in list_tables(estimates):
+        if ("walk_trial" in filename or "run_trial" in filename or "mixed_trial" in filename) and filename.endswith(".csv"):
+            file_path = os.path.join(estimates, filename)
+            data = load_table(file_path)
+
+            # XY Plane
+            last_values = data[-1, :2]
+            if "walk_trial" in filename:
+                total['walk'].append(calc_dist(last_values))
+            elif "run_trial" in filename:
+                total['run'].append(calc_dist(last_values))
+            else:
+                total['mixed'].append(calc_dist(last_values))
+
+            #print(f"File: {filename}, XY distance: {calc_dist(last_values)}")
+
+        if ("stairs_trial" in filename) and filename.endswith(".csv"):
+            file_path = os.path.join(estimates, filename)
+            data = load_table(file_path)
+
+            # XYZ Space
+            last_values = data[-1, :3]
+            if "1F" in filename:
+                total['1F'].append(calc_dist(last_values))
+            elif "2F" in filename:
+                total['2F'].append(calc_dist(last_values))
+            else:
+                total['3F'].append(calc_dist(last_values))
+
+            #print(f"File: {filename}, XYZ distance: {calc_dist(last_values)}")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates the error statistics of the real-time and full estimates.")
+    parser.add_argument("--engine", default="parallel", choices=["parallel", "batched", "serial"], help="Process the full estimates one trial per worker process (parallel), all trials together in lockstep (batched) or one trial at a time (serial)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for the parallel engine (default: number of CPUs)")
+    parser.add_argument("--no-cache", action="store_true", help="Recalculate every full estimate without reading or writing the cache")
+    parser.add_argument("--cache-dir", default="results/cache", help="Directory of the full estimate cache")
+    parser.add_argument("--cache-size", type=float, default=256, help="Maximum size of the full estimate cache in MB")
+    args = parser.parse_args()
+
+    # Distances travelled for the different conditions
+    dists = {'walk':42.8, 'run':42.8, 'mixed':42.8, '1F':9.1, '2F':24.95, '3F':40.8}
+    # Real-time estimates
+    total = realtime_errors('results/estimates')
+
+    print (total)
+    for x in total:
+        mean = sum(total[x]) / 9
+        # Average loop closure error
+        print (x + ' position error: ' + str(round(mean,4)) + 'm')
+        # Average relative error
+        print (x + ' relative error: ' + str(round((mean/dists[x])*100, 4)) + '%')
+        # Standard deviation
+        print (x + ' sd: ' + str(round(math.sqrt(sum((val - mean) ** 2 for val in total[x]) / (len(total[x]) - 1)),4)))
+
+    total_full = {'walk':[], 'run':[], 'mixed':[], '1F':[], '2F':[], '3F':[]}
+    dirs = ['walk', 'run', 'mixed', 'stairs']
+    # Trials as (trial type, trial speed, file name), and the condition each belongs to
+    trials = []
+    conditions = []
+    for d in dirs:
+        if d == 'stairs':
+            full = 'data/'+d
+            for filename in list_tables(full):
+                if ('trial' in filename) and filename.endswith(".csv"):
+                    trials.append(('stairs', '', filename))
+                    if "1F" in filename:
+                        conditions.append('1F')
+                    elif "2F" in filename:
+                        conditions.append('2F')
+                    else:
+                        conditions.append('3F')
+        else:
+            full = 'data/hallway/'+d
+            for filename in list_tables(full):
+                if ('trial' in filename) and filename.endswith(".csv"):
+                    trials.append(('hallway', d, filename))
+                    conditions.append(d)
+
+    # Reuses cached estimates, only trials whose data or parameters changed are recalculated
+    results = [None] * len(trials)
+    cache = None if args.no_cache else EstimateCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    if cache is not None:
+        keys = [cache.key(os.path.join('data', *trial)) for trial in trials]
+        results = [cache.load(key) for key in keys]
+    missing = [i for i, x in enumerate(results) if x is None]
+    print (f"Full estimates: {len(trials) - len(missing)} cached, {len(missing)} to calculate")
+
+    if missing:
+        if args.engine == "batched":
+            calculated = full_estimates_batch([trials[i] for i in missing])
+        elif args.engine == "parallel":
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                calculated = list(executor.map(full_estimates, *zip(*[trials[i] for i in missing])))
+        else:
+            calculated = [full_estimates(*trials[i]) for i in missing]
+        for i, x in zip(missing, calculated):
+            results[i] = x
+            if cache is not None:
+                cache.store(keys[i], x)
+
+    for trial, condition, x in zip(trials, conditions, results):
+        # XYZ space for stairs, XY plane for hallway
+        total_full[condition].append(calc_dist(x[-1,:3] if trial[0] == 'stairs' else x[-1,:2]))
+
+    print (total_full)
+    for x in total_full:
+        mean = sum(total_full[x]) / 9
+        print (x + ' full position error: ' + str(round(mean,4)) + 'm')
+        print (x + ' full relative error: ' + str(round((mean/dists[x])*100, 4)) + '%')
+        print (x + ' sd: ' + str(round(math.sqrt(sum((val - mean) ** 2 for val in total[x]) / (len(total[x]) - 1)),4)))
 
+if __name__ == "__main__":
+    main()
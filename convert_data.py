@@ -0,0 +1,37 @@
+import numpy as np
+import os
+import argparse
+from ins_tools.storage import binary_path, convert_csv
+
+# Converts the raw IMU data and estimate CSV files to binary copies the loaders memory-map instead of parsing
+parser = argparse.ArgumentParser(description="Converts CSV tables of raw IMU data and estimates to binary .npy copies.")
+parser.add_argument("paths", nargs="*", default=["data", "results/estimates"], help="CSV files or directories searched recursively (default: data and results/estimates)")
+parser.add_argument("--force", action="store_true", help="Converts even the files whose binary copy is up to date")
+parser.add_argument("--verify", action="store_true", help="Checks that every binary copy matches its CSV file exactly")
+args = parser.parse_args()
+
+files = []
+for path in args.paths:
+    if os.path.isdir(path):
+        for root, _, names in sorted(os.walk(path)):
+            files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith('.csv'))
+    else:
+        files.append(path)
+
+converted = 0
+csv_size = 0
+binary_size = 0
+mismatches = 0
+for path in files:
+    if convert_csv(path, force=args.force):
+        converted += 1
+    csv_size += os.path.getsize(path)
+    binary_size += os.path.getsize(binary_path(path))
+    if args.verify and not np.array_equal(np.load(binary_path(path)), np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)):
+        mismatches += 1
+        print("Mismatch: " + path)
+
+print(f"{converted} of {len(files)} files converted, {len(files) - converted} already up to date")
+print(f"CSV: {csv_size/1e6:.1f} MB, binary: {binary_size/1e6:.1f} MB")
+if args.verify:
+    print(f"{mismatches} mismatches")
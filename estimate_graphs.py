@@ -1,15 +1,15 @@
 import tools
 import os
-import numpy as np
+from ins_tools.storage import load_table, list_tables
 
 # Regenerates all the real-time trajectory graphs by using the state estimates collected during the testing trials.
 directory = 'results/estimates'
-for filename in sorted(os.listdir(directory)):
+for filename in list_tables(directory):
      # Filter to get the trial CSV files
     if ("walk_trial" in filename or "run_trial" in filename or "stairs_trial" in filename or "mixed_trial" in filename) and filename.endswith(".csv"): 
         file_path = os.path.join(directory, filename)
         print (filename)
-        data = np.loadtxt(file_path, delimiter=",", skiprows=1)
+        data = load_table(file_path)
         positions = data[:, :3]
         zv = data[:, -1].astype(bool)
 
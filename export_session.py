@@ -0,0 +1,20 @@
+import os
+import argparse
+from ins_tools.session import load_session, export_session
+
+# Exports sessions recorded incrementally by the application to the raw data and estimates CSV files
+parser = argparse.ArgumentParser(description="Exports recorded sessions to the raw data and estimates CSV files.")
+parser.add_argument("sessions", nargs="*", help="Session directories (default: every session in results/sessions)")
+args = parser.parse_args()
+
+sessions = args.sessions
+if not sessions:
+    sessions = [os.path.join('results/sessions', name) for name in sorted(os.listdir('results/sessions'))]
+
+for session in sessions:
+    index, raw, timestamps, estimates, zv = load_session(session)
+    if not index['complete']:
+        print(f"Session {session} was not finalized, exporting the {raw.shape[0]} samples written before it stopped")
+    raw_path, estimates_path = export_session(session)
+    print("Raw data CSV file created at: "+raw_path)
+    print("Estimates CSV file created at: "+estimates_path)
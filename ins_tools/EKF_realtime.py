@@ -1,6 +1,7 @@
 import numpy as np
 from numpy import linalg as LA
-from ins_tools.geometry_helpers import quat2mat, mat2quat, euler2quat, quat2euler
+import math
+from ins_tools.geometry_helpers import quat2mat, mat2quat, euler2quat, quat2euler, qmult, _FLOAT_EPS, _EPS4
 import sys
 sys.path.append('../')
 
@@ -21,8 +22,8 @@ class Localizer():
         self.x = np.zeros((imubatch.shape[0],9))
         # Quaternion
         self.q = np.zeros((imubatch.shape[0],4))
-        # Covariance matrix
-        self.P_hat = np.zeros((imubatch.shape[0],9,9))
+        # Covariance matrix of the latest sample, the filter updates this single matrix in place
+        self.P = np.zeros((9,9))
 
         avg_x = np.mean(imubatch[0:20,0])
         avg_y = np.mean(imubatch[0:20,1])
@@ -36,31 +37,123 @@ class Localizer():
         # first timestamp 
         self.x[0, 6:9] = attitude # first timestamp 
         self.q[0, :] = euler2quat(roll, pitch, heading, 'sxyz')
-        self.P_hat[0,0:3,0:3] = np.power(1e-5,2)*np.identity(3) #position (x,y,z) variance
-        self.P_hat[0,3:6,3:6] = np.power(1e-5,2)*np.identity(3) #velocity (x,y,z) variance
-        self.P_hat[0,6:9,6:9] = np.power(0.1*np.pi/180,2)*np.identity(3)
+        self.P[0:3,0:3] = np.power(1e-5,2)*np.identity(3) #position (x,y,z) variance
+        self.P[3:6,3:6] = np.power(1e-5,2)*np.identity(3) #velocity (x,y,z) variance
+        self.P[6:9,6:9] = np.power(0.1*np.pi/180,2)*np.identity(3)
+
+        # Covariance history kept per batch: "full" every sample, "every" every cov_every-th sample
+        # counted from the start of the recording, "latest" only the last sample of the batch
+        self.cov_history = self.config["cov_history"]
+        self.cov_every = self.config["cov_every"]
+        self.keep_cov = {"full": self._keep_cov_full, "every": self._keep_cov_every, "latest": self._keep_cov_latest}[self.cov_history]
+        # Index of the first sample of the batch since the start of the recording
+        self.batch_start = 0
+        self.P_hat, self.P_index = self._cov_batch(imubatch.shape[0], first=True)
+        self.keep_cov(0, self.P)
+
+        # Streaming zero-velocity detector state: samples of the unfinished window and the last
+        # (sample, detection) pair handed out
+        self.zv_tail = np.zeros((0,imubatch.shape[1]))
+        self.zv_last = None
+
+        # Process noise on the velocity and attitude errors. Q is isotropic, so G Q G^T = dt^2 * Qc
+        # whatever the attitude and is only recomputed when the time step changes
+        self.Qc = np.zeros((9,9))
+        self.Qc[3:6,3:6] = self.config["Q"][0:3,0:3]
+        self.Qc[6:9,6:9] = self.config["Q"][3:6,3:6]
+        self.Qd = None
+        self.Qd_dt = None
+        # Measurement noise covariance, cached as scalars for the ZUPT update
+        self.R = self.config["R"].tolist()
+        # Scratch buffers for the covariance propagation and ZUPT update
+        self.N = np.zeros((6,6)) # non-zero rows and columns of F - I
+        self.S = self.N[3:6,3:6] # -dt * skew-symmetric matrix of the specific force
+        self.E = np.zeros((9,9)) # M + M N^T / 2, only the first six rows are used
+        self.E_sym = np.zeros((9,9))
+        self.MN = np.zeros((6,6))
+        self.L_inv = np.zeros((3,3))
+        self.W = np.zeros((9,3))
+        self.WW = np.zeros((9,9))
     
     def getXQP(self): 
-        """Returns the states, orientations, and covariance matrices"""
+        """Returns the states, orientations, and retained covariance matrices"""
         return self.x, self.q, self.P_hat
     
     # Replaces the previous batch with new empty batch with the first value the last value the previous batch
     def nextBatch(self, imushape):
         """
         Initialises a new state batch using the last values of the current batch.
+        The covariance matrix carries over in self.P.
 
         :param imushape: Number of samples in the next IMU batch
 
-        :return: New batch for states, orientations, and covariance matrices initialised with the last known state
+        :return: New batch for states, orientations, and retained covariance matrices initialised with the last known state
         """
         x = np.zeros((imushape,9))
         q = np.zeros((imushape,4))
-        P_hat = np.zeros((imushape,9,9))     
         x[0] = self.x[-1]
         q[0] = self.q[-1]
-        P_hat[0] = self.P_hat[-1]
-        self.x, self.q, self.P_hat = x, q, P_hat
+        # The first sample of the new batch is the last sample of the previous one
+        self.batch_start += self.x.shape[0] - 1
+        self.x, self.q = x, q
+        self.P_hat, self.P_index = self._cov_batch(imushape, first=False)
+        self.keep_cov(0, self.P)
+        return self.x, self.q, self.P_hat
+
+    def firstBatch(self, imushape):
+        """
+        Resizes the initial state batch, keeping the initial state in its first row.
+
+        :param imushape: Number of samples in the first IMU batch
+
+        :return: First batch for states, orientations, and retained covariance matrices
+        """
+        x = np.zeros((imushape,9))
+        q = np.zeros((imushape,4))
+        x[0] = self.x[0]
+        q[0] = self.q[0]
+        self.x, self.q = x, q
+        self.P_hat, self.P_index = self._cov_batch(imushape, first=True)
+        self.keep_cov(0, self.P)
         return self.x, self.q, self.P_hat
+
+    def _cov_batch(self, n, first):
+        """
+        Allocates the covariance history of a batch according to the retention policy.
+
+        :param n: Number of samples in the batch
+        :param first: Whether this is the first batch, whose first sample is not carried over
+
+        :returns:
+            - **P_hat** (*ndarray*) – Array for the retained covariance matrices
+            - **P_index** (*ndarray*) – Sample indices since the start of the recording of the retained matrices
+        :rtype: tuple (ndarray, ndarray)
+        """
+        if self.cov_history == "full":
+            index = np.arange(self.batch_start, self.batch_start + n)
+        elif self.cov_history == "every":
+            # The carried over sample was already retained with the previous batch
+            start = self.batch_start if first else self.batch_start + 1
+            first_kept = -(-start // self.cov_every) * self.cov_every
+            index = np.arange(first_kept, self.batch_start + n, self.cov_every)
+        else:
+            index = np.array([self.batch_start + n - 1])
+        return np.zeros((index.shape[0],9,9)), index
+
+    def _keep_cov_full(self, k, P):
+        """Retains the covariance matrix of sample k of the batch."""
+        self.P_hat[k] = P
+
+    def _keep_cov_every(self, k, P):
+        """Retains the covariance matrix of sample k of the batch if it is a multiple of cov_every."""
+        i = self.batch_start + k
+        if i % self.cov_every == 0 and self.P_index.size and i >= self.P_index[0]:
+            self.P_hat[(i - self.P_index[0]) // self.cov_every] = P
+
+    def _keep_cov_latest(self, k, P):
+        """Retains the covariance matrix of the last sample of the batch."""
+        if k == self.x.shape[0] - 1:
+            self.P_hat[0] = P
         
     def nav_eq(self,xin,imu,qin,dt):
         """
@@ -145,13 +238,18 @@ class Localizer():
         return F,G
     
     # Corrects the predicted state using zero-velocity updates (ZUPTs) and the Kalman filter correction step
-    def corrector(self, x_check, P_check, Rot):
+    def corrector(self, x_check, P_check, Rot, q):
         """
         EKF correction step for the predicted states using zero-velocity updates.
 
+        The attitude error is injected according to config["attitude_correction"]: "quaternion" multiplies
+        q by the small-angle error quaternion and renormalises, "matrix" applies it to the rotation matrix
+        and recovers the quaternion with mat2quat (eigendecomposition), as originally implemented.
+
         :param x_check: State vector
         :param P_check: Covariance matrix
         :param Rot: Rotation matrix
+        :param q: Quaternion corresponding to Rot
 
         :returns: 
             - **x_check** (*ndarray*) – Updated state vector
@@ -159,32 +257,94 @@ class Localizer():
             - **q** (*ndarray*) – Updated quaternion representing the corrected orientation
         :rtype: tuple (ndarray, ndarray, ndarray)
         """
-        # Identity matrices 
-        eye3 = np.identity(3) # Attitude correction
-        eye9 = np.identity(9) # Covariance updates
-        omega = np.zeros((3,3)) # Store skew-symmetric matrix for small roation corrections        
-        
-        # Uses the measurement model (H) and measurement noise (R) to compute the Kalman gain
-        K = (P_check.dot(self.config["H"].T)).dot(LA.inv((self.config["H"].dot(P_check)).dot(self.config["H"].T) + self.config["R"]))
         z = -x_check[3:6] ### true state is 0 velocity, current velocity is error
-        q=mat2quat(Rot)   
-        # State correction
-        dx = K.dot(z) 
+        # State correction, also updates the covariance matrix in place
+        dx = self.zupt_update(P_check, z, P_check)
         x_check += dx  ###inject position and velocity error
         
-        # Constructs the skew-symmetric matrix representing small rotation correction
-        omega[0:3,0:3] = [[0,-dx[8], dx[7]],[dx[8],0,-dx[6]],[-dx[7],dx[6],0]] 
-        # Rotation matrix updated using correction
-        Rot = (eye3+omega).dot(Rot)
-        q = mat2quat(Rot)
+        if self.config["attitude_correction"] == "matrix":
+            # Constructs the skew-symmetric matrix representing small rotation correction
+            omega = np.array([[0,-dx[8], dx[7]],[dx[8],0,-dx[6]],[-dx[7],dx[6],0]])
+            # Rotation matrix updated using correction
+            Rot = (np.identity(3)+omega).dot(Rot)
+            q = mat2quat(Rot)
+        else:
+            # Error quaternion of the small rotation correction applied on the left, (I + [dx]x) Rot
+            q = qmult(np.array([1.0, 0.5*dx[6], 0.5*dx[7], 0.5*dx[8]]), q)
+            q /= LA.norm(q)
+            # Prefer quaternion with positive w, as mat2quat does
+            if q[0] < 0:
+                q = -q
         attitude = quat2euler(q,'sxyz')
         # Store the updated attitude
         x_check[6:9] = attitude    #Inject rotational error 
-        # Covariance update equation to reduce uncertainty based on measurement update        
-        P_check = (eye9-K.dot(self.config["H"])).dot(P_check)
-        P_check = (P_check + P_check.T)/2
         return x_check, P_check, q
 
+    def propagate_cov(self, P_in, f_n, dt, P_out):
+        """
+        Propagates the covariance matrix, P = F P F^T + G Q G^T, using the block structure of F.
+        F is the identity plus N, whose only blocks are dt*I (velocity to position) and -dt*[f_n]x
+        (attitude to velocity). With M = N P the product expands to P + C + C^T where C = M + M N^T/2
+        has only six non-zero rows, so the result is symmetric by construction.
+
+        :param P_in: Previous covariance matrix
+        :param f_n: Specific force in the navigation frame at the previous attitude
+        :param dt: Time step for numerical integration
+        :param P_out: Covariance matrix the result is written to, may be P_in
+        """
+        if dt != self.Qd_dt:
+            self.Qd = dt*dt*self.Qc
+            self.N[0:3,0:3] = dt*np.identity(3)
+            self.Qd_dt = dt
+        fx, fy, fz = f_n
+        self.S.flat = 0.0, dt*fz, -dt*fy, -dt*fz, 0.0, dt*fx, dt*fy, -dt*fx, 0.0
+        # Rows 0:6 of N P only need rows 3:9 of P, and the non-zero columns of M N^T only need
+        # columns 3:9 of M
+        C = self.E[0:6]
+        np.dot(self.N, P_in[3:9], out=C)
+        np.dot(C[:,3:9], self.N.T, out=self.MN)
+        self.MN *= 0.5
+        C[:,0:6] += self.MN
+        np.add(self.E, self.E.T, out=self.E_sym)
+        np.add(P_in, self.E_sym, out=P_out)
+        P_out += self.Qd
+
+    def zupt_update(self, P, z, P_out):
+        """
+        Kalman update for a zero-velocity measurement. H only selects the velocity block, so the gain is
+        K = P[:,3:6] (P[3:6,3:6] + R)^-1, computed with a closed-form 3x3 Cholesky factor L. With
+        W = P[:,3:6] L^-T the update is dx = W L^-1 z and P = P - W W^T, which stays symmetric.
+
+        :param P: Predicted covariance matrix
+        :param z: Velocity measurement residual
+        :param P_out: Covariance matrix the result is written to, may be P
+
+        :return: State correction
+        """
+        (s00, _, _), (s10, s11, _), (s20, s21, s22) = P[3:6,3:6].tolist()
+        (r00, _, _), (r10, r11, _), (r20, r21, r22) = self.R
+        # Cholesky factor of the innovation covariance
+        l00 = math.sqrt(s00 + r00)
+        l10 = (s10 + r10)/l00
+        l20 = (s20 + r20)/l00
+        l11 = math.sqrt(s11 + r11 - l10*l10)
+        l21 = (s21 + r21 - l20*l10)/l11
+        l22 = math.sqrt(s22 + r22 - l20*l20 - l21*l21)
+        # Inverse of the lower triangular factor
+        m00 = 1/l00
+        m11 = 1/l11
+        m22 = 1/l22
+        m10 = -l10*m00*m11
+        m21 = -l21*m11*m22
+        m20 = -(l20*m00 + l21*m10)*m22
+        self.L_inv.flat = m00, 0.0, 0.0, m10, m11, 0.0, m20, m21, m22
+        z0, z1, z2 = z
+        np.dot(P[:,3:6], self.L_inv.T, out=self.W)
+        dx = self.W.dot((m00*z0, m10*z0 + m11*z1, m20*z0 + m21*z1 + m22*z2))
+        np.dot(self.W, self.W.T, out=self.WW)
+        np.subtract(P, self.WW, out=P_out)
+        return dx
+
     # Stationary Hypothesis Optimal Estimator (SHOE)
     def SHOE(self, imudata, W=5):
         """
@@ -197,39 +357,59 @@ class Localizer():
 
         :returns: Array containing zero-velocity detection statistics for each IMU sample
         """
-        # Vector storing test statistics for each window
-        T = np.zeros(np.int(np.floor(imudata.shape[0]/W)+1))
-        # Zero velocity indicator array
+        # Zero velocity indicator array, samples after the last full window are left at 0
         zupt = np.zeros(imudata.shape[0])
-        # Temporary arrays for storing accelertion and angular velocity
-        a = np.zeros((1,3))
-        w = np.zeros((1,3))
+        # Number of complete non-overlapping windows
+        n_win = imudata.shape[0] // W
+        if n_win == 0:
+            return zupt
         # Inverse of accelerometer and gyroscope noise variance
         inv_a = (1/self.config["var_a"])
         inv_w = (1/self.config["var_w"])
-        acc = imudata[:,0:3]
-        gyro = imudata[:,3:6]
-
-        # Divides IMU data into non-overlapping windows
-        i=0
-        for k in range(0,imudata.shape[0]-W+1,W): 
-            # Mean acceleration
-            smean_a = np.mean(acc[k:k+W,:],axis=0)
-            # Loop through each sample in the window and check if stationary
-            for s in range(k,k+W):
-                # Update acceleration and angular velocity
-                a.put([0,1,2],acc[s,:])
-                w.put([0,1,2],gyro[s,:])
-                # Add contribution of acceleration to test statistic
-                T[i] += inv_a*( (a - self.config["g"]*smean_a/LA.norm(smean_a)).dot(( a - self.config["g"]*smean_a/LA.norm(smean_a)).T)) #acc terms
-                # Add contribution of angular velocity to the test statistic
-                T[i] += inv_w*( (w).dot(w.T) )
-            zupt[k:k+W].fill(T[i])
-            i+=1
+        # Group the samples of each window together, shape (windows, W, 3)
+        acc = imudata[:n_win*W,0:3].reshape(n_win,W,3)
+        gyro = imudata[:n_win*W,3:6].reshape(n_win,W,3)
+
+        # Mean acceleration of each window scaled to the magnitude of gravity
+        smean_a = np.mean(acc,axis=1)
+        g_dir = self.config["g"]*smean_a/LA.norm(smean_a,axis=1)[:,None]
+        # Squared residuals of every sample, shape (windows, W)
+        res_a = acc - g_dir[:,None,:]
+        res_a = np.einsum('ijk,ijk->ij', res_a, res_a)
+        res_w = np.einsum('ijk,ijk->ij', gyro, gyro)
+
+        # Vector storing test statistics for each window, accumulated per sample in window order
+        T = np.zeros(n_win)
+        for s in range(W):
+            T += inv_a*res_a[:,s] #acc terms
+            T += inv_w*res_w[:,s]
         # Test statistic normalised by window size
-        zupt = zupt/W
+        zupt[:n_win*W] = np.repeat(T, W)/W
         return zupt
-        
+
+    def SHOE_stream(self, imudata, W=5, flush=False):
+        """
+        Streaming version of SHOE that accepts batches of any size. Samples that do not complete a
+        window are kept and prepended to the next call, so the windows line up with those SHOE
+        would use on the whole recording.
+
+        :param imudata: New IMU samples since the previous call
+        :param W: Window size for batch processing
+        :param flush: Also returns the samples of the unfinished window, used for the final batch
+
+        :returns:
+            - **imu** (*ndarray*) – IMU samples of the newly completed windows
+            - **zupt** (*ndarray*) – Zero-velocity detection statistics for those samples
+        :rtype: tuple (ndarray, ndarray)
+        """
+        if self.zv_tail.shape[0] > 0:
+            imudata = np.concatenate((self.zv_tail, imudata))
+        ready = imudata.shape[0] if flush else (imudata.shape[0] // W) * W
+        # Copy so the tail does not keep the caller's array alive
+        self.zv_tail = imudata[ready:].copy()
+        imu = imudata[:ready]
+        return imu, self.SHOE(imu, W=W)
+
     def compute_zv_lrt(self, imudata, W=5, G=3e8, return_zv=True):
         """Compares likelihoods against a threshold to determine whether zero velocity is detected"""
         zv = self.SHOE(imudata=imudata, W=W)
@@ -237,4 +417,215 @@ class Localizer():
             zv=zv<G
         return zv
 
-        
+    def compute_zv_lrt_stream(self, imudata, W=5, G=3e8, flush=False):
+        """
+        Streaming zero-velocity detection for batches of any size.
+
+        The returned batch follows the layout expected by INS.baseline: after the first call its
+        first row repeats the last sample returned previously, so it can be processed with
+        init set to False and its first estimate dropped. Nothing is returned until a window completes.
+
+        :param imudata: New IMU samples since the previous call
+        :param W: Window size for batch processing
+        :param G: Threshold for the zero-velocity detector
+        :param flush: Also processes the samples of the unfinished window, used for the final batch
+
+        :returns:
+            - **imubatch** (*ndarray*) – IMU batch ready for INS.baseline
+            - **zv** (*ndarray*) – Binary array of zero-velocity detections for the batch
+        :rtype: tuple (ndarray, ndarray)
+        """
+        imu, zv = self.SHOE_stream(imudata, W=W, flush=flush)
+        zv = zv<G
+        if imu.shape[0] == 0:
+            return imu, zv
+        if self.zv_last is not None:
+            # Overlap with the last sample of the previous batch
+            imu = np.concatenate((self.zv_last[0][None,:], imu))
+            zv = np.concatenate(([self.zv_last[1]], zv))
+        self.zv_last = (imu[-1].copy(), zv[-1])
+        return imu, zv
+
+
+def _quat2rot(qw, qx, qy, qz):
+    """Closed-form quat2mat on scalars, returns the rotation matrix as a row-major tuple of 9 floats"""
+    Nq = qw*qw + qx*qx + qy*qy + qz*qz
+    if Nq < _FLOAT_EPS:
+        return 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0
+    s = 2.0/Nq
+    X = qx*s; Y = qy*s; Z = qz*s
+    wX = qw*X; wY = qw*Y; wZ = qw*Z
+    xX = qx*X; xY = qx*Y; xZ = qx*Z
+    yY = qy*Y; yZ = qy*Z; zZ = qz*Z
+    return (1.0-(yY+zZ), xY-wZ, xZ+wY,
+            xY+wZ, 1.0-(xX+zZ), yZ-wX,
+            xZ-wY, yZ+wX, 1.0-(xX+yY))
+
+def _rot2euler(r00, r10, r11, r12, r20, r21, r22):
+    """Closed-form mat2euler for the 'sxyz' convention, only takes the matrix entries it needs"""
+    cy = math.sqrt(r00*r00 + r10*r10)
+    if cy > _EPS4:
+        return math.atan2(r21, r22), math.atan2(-r20, cy), math.atan2(r10, r00)
+    return math.atan2(-r12, r11), math.atan2(-r20, cy), 0.0
+
+def _mat2quat_near(m, q0, tol=1e-14, max_iter=50):
+    """
+    mat2quat for a matrix close to the rotation of a known quaternion. Finds the same maximum eigenvector
+    of the Bar-Itzhack K matrix by power iteration on 3K + I, whose other eigenvalues are close to zero
+    for a near-orthogonal matrix, so a couple of iterations from q0 reach float precision.
+
+    :param m: Matrix entries as a row-major sequence of 9 floats
+    :param q0: Initial guess of the quaternion (w, x, y, z)
+    :param tol: Stops once the quaternion changes by less than this between iterations
+    :param max_iter: Maximum number of power iterations
+
+    :returns: Unit quaternion (w, x, y, z) with positive w, as a list
+    """
+    Qxx, Qyx, Qzx, Qxy, Qyy, Qzy, Qxz, Qyz, Qzz = m
+    k00 = Qxx - Qyy - Qzz + 1.0
+    k11 = Qyy - Qxx - Qzz + 1.0
+    k22 = Qzz - Qxx - Qyy + 1.0
+    k33 = Qxx + Qyy + Qzz + 1.0
+    k10 = Qyx + Qxy; k20 = Qzx + Qxz; k30 = Qyz - Qzy
+    k21 = Qzy + Qyz; k31 = Qzx - Qxz; k32 = Qxy - Qyx
+    w, x, y, z = q0
+    for _ in range(max_iter):
+        a = k00*x + k10*y + k20*z + k30*w
+        b = k10*x + k11*y + k21*z + k31*w
+        c = k20*x + k21*y + k22*z + k32*w
+        d = k30*x + k31*y + k32*z + k33*w
+        n = math.sqrt(a*a + b*b + c*c + d*d)
+        a /= n; b /= n; c /= n; d /= n
+        delta = abs(a - x) + abs(b - y) + abs(c - z) + abs(d - w)
+        x, y, z, w = a, b, c, d
+        if delta < tol:
+            break
+    # Prefer quaternion with positive w
+    if w < 0:
+        return [-w, -x, -y, -z]
+    return [w, x, y, z]
+
+class FastLocalizer(Localizer):
+    """
+    Localizer backend that fuses the prediction, covariance propagation and zero-velocity correction
+    of a sample into a single step. Works on Python scalars and preallocated scratch buffers with
+    cached configuration values, so no matrices are allocated per sample. Gives the same estimates as
+    Localizer to float tolerance.
+
+    :param config: Dictionary of configuration parameters
+    :param imubatch: Initial batch of IMU data
+    """
+    def __init__(self, config, imubatch):
+        super().__init__(config, imubatch)
+        # Cached configuration values
+        self.g = self.config["g"]
+        self.attitude_matrix = self.config["attitude_correction"] == "matrix"
+
+    def step(self, x_in, q_in, imu, zv, dt, P_in, P_out):
+        """
+        Fused EKF step for a single sample.
+
+        :param x_in: Previous state vector as a list of 9 floats
+        :param q_in: Previous quaternion as a list of 4 floats
+        :param imu: IMU sample as a list of 6 floats
+        :param zv: Zero-velocity detection for the sample
+        :param dt: Time step for numerical integration
+        :param P_in: Previous covariance matrix
+        :param P_out: Covariance matrix the result is written to
+
+        :returns:
+            - **x_out** (*list*) – Updated state vector
+            - **q_out** (*list*) – Updated quaternion
+        :rtype: tuple (list, list)
+        """
+        ax, ay, az, wx, wy, wz = imu
+        qw, qx, qy, qz = q_in
+
+        # Quaternion propagation using the small-angle rotation formula
+        norm_w = math.sqrt(wx*wx + wy*wy + wz*wz)
+        if norm_w*dt != 0:
+            c = math.cos(dt*norm_w/2)
+            s = (1/norm_w)*math.sin(dt*norm_w/2)
+            sx = s*wx; sy = s*wy; sz = s*wz
+            q_out = [c*qw - sx*qx - sy*qy - sz*qz,
+                     sx*qw + c*qx + sz*qy - sy*qz,
+                     sy*qw - sz*qx + c*qy + sx*qz,
+                     sz*qw + sy*qx - sx*qy + c*qz]
+        else:
+            q_out = [qw, qx, qy, qz]
+
+        # Navigation equations with the rotation of the propagated quaternion
+        r00, r01, r02, r10, r11, r12, r20, r21, r22 = _quat2rot(*q_out)
+        acc_x = r00*ax + r01*ay + r02*az
+        acc_y = r10*ax + r11*ay + r12*az
+        acc_z = r20*ax + r21*ay + r22*az + self.g
+        vx = x_in[3] + dt*acc_x
+        vy = x_in[4] + dt*acc_y
+        vz = x_in[5] + dt*acc_z
+        hdt2 = 0.5*dt*dt
+        x_out = [x_in[0] + dt*vx + hdt2*acc_x,
+                 x_in[1] + dt*vy + hdt2*acc_y,
+                 x_in[2] + dt*vz + hdt2*acc_z,
+                 vx, vy, vz]
+        x_out.extend(_rot2euler(r00, r10, r11, r12, r20, r21, r22))
+
+        # Covariance propagation with the specific force at the previous attitude
+        p00, p01, p02, p10, p11, p12, p20, p21, p22 = _quat2rot(qw, qx, qy, qz)
+        self.propagate_cov(P_in, (p00*ax + p01*ay + p02*az,
+                                  p10*ax + p11*ay + p12*az,
+                                  p20*ax + p21*ay + p22*az), dt, P_out)
+
+        if not zv:
+            return x_out, q_out
+
+        # True state is zero velocity, the current velocity is the error
+        dx = self.zupt_update(P_out, (-x_out[3], -x_out[4], -x_out[5]), P_out).tolist()
+        x_out = [xi + dxi for xi, dxi in zip(x_out, dx)]
+        # Multiply by the small-angle error quaternion of the rotational error
+        qw, qx, qy, qz = q_out
+        hx = 0.5*dx[6]; hy = 0.5*dx[7]; hz = 0.5*dx[8]
+        q_out = [qw - hx*qx - hy*qy - hz*qz,
+                 qx + qw*hx + hy*qz - hz*qy,
+                 qy + qw*hy + hz*qx - hx*qz,
+                 qz + qw*hz + hx*qy - hy*qx]
+        if self.attitude_matrix:
+            # Same quaternion mat2quat would give for the corrected rotation matrix (I + [dx]x) Rot
+            e0, e1, e2 = dx[6], dx[7], dx[8]
+            Rot = (r00 - e2*r10 + e1*r20, r01 - e2*r11 + e1*r21, r02 - e2*r12 + e1*r22,
+                   e2*r00 + r10 - e0*r20, e2*r01 + r11 - e0*r21, e2*r02 + r12 - e0*r22,
+                   -e1*r00 + e0*r10 + r20, -e1*r01 + e0*r11 + r21, -e1*r02 + e0*r12 + r22)
+            q_out = _mat2quat_near(Rot, q_out)
+        else:
+            n = math.sqrt(q_out[0]*q_out[0] + q_out[1]*q_out[1] + q_out[2]*q_out[2] + q_out[3]*q_out[3])
+            if q_out[0] < 0: # Prefer quaternion with positive w
+                n = -n
+            q_out = [qi/n for qi in q_out]
+        r00, r01, r02, r10, r11, r12, r20, r21, r22 = _quat2rot(*q_out)
+        x_out[6:9] = _rot2euler(r00, r10, r11, r12, r20, r21, r22)
+        return x_out, q_out
+
+    def run(self, imudata, zv, dt):
+        """
+        Runs the fused step over the current batch, filling the state and quaternion arrays of the
+        batch in place and updating the covariance matrix in place, retained according to the policy. The first sample holds the initial or carried over state.
+
+        :param imudata: IMU batch data, with the time step before each sample as a seventh column if per-sample
+        :param zv: Binary array indicating zero-velocity detection
+        :param dt: Time step for numerical integration, unless per-sample
+        """
+        imu = imudata[:,0:6].tolist()
+        dts = imudata[:,6].tolist() if imudata.shape[1] > 6 else [dt]*imudata.shape[0]
+        zv = np.asarray(zv).tolist()
+        xs = [self.x[0].tolist()]
+        qs = [self.q[0].tolist()]
+        P = self.P
+        keep_cov = self.keep_cov
+        for k in range(1,self.x.shape[0]):
+            x_prev, q_prev = self.step(xs[-1], qs[-1], imu[k], zv[k], dts[k], P, P)
+            keep_cov(k, P)
+            xs.append(x_prev)
+            qs.append(q_prev)
+        # Written back once instead of per sample
+        self.x[:] = xs
+        self.q[:] = qs
+
@@ -0,0 +1,192 @@
+import numpy as np
+from ins_tools.geometry_helpers import quat2mat_batch, mat2euler_batch, euler2quat_batch
+
+class BatchINS():
+    """
+    Runs the INS over several independent recordings in lockstep. The recordings are padded to the
+    longest one and their states, quaternions and covariance matrices are propagated together as
+    (K,9), (K,4) and (K,9,9) arrays, with ZUPT corrections applied per recording through boolean masks.
+    Gives the same estimates as running INS on each recording to float tolerance, while the Python
+    overhead scales with the longest recording instead of the total number of samples.
+
+    Only the latest covariance matrix of each recording is kept. ZUPT attitude corrections use the
+    error quaternion, as INS does by default.
+
+    :param imudata: List of K arrays of IMU data, one per recording
+    :param sigma_a: Standard deviation of accelerometer noise (default: 0.01)
+    :param sigma_w: Standard deviation of gyroscope noise in rad/s (default: 0.01 deg converted to rad)
+    :param T: Sampling period in seconds (default: 1/100)
+    :param g: Gravitational acceleration in m/s^2 (default: 9.8029)
+    """
+    def __init__(self, imudata, sigma_a=0.01, sigma_w=0.01*np.pi/180, T=1.0/100, g=9.8029):
+        # Same configuration as INS
+        self.config = {
+        "sigma_a": sigma_a,
+        "sigma_w": sigma_w,
+        "g": g,
+        "T": T,
+            }
+        self.var_a = np.power(sigma_a,2)
+        self.var_w = np.power(sigma_w,2)
+        self.config["var_a"] = self.var_a
+        self.config["var_w"] = self.var_w
+        self.g = self.config["g"]
+        self.T = self.config["T"]
+        var_acc = np.power(0.5,2)
+        var_gyro = np.power(0.5*np.pi/180,2)
+        # Process noise, G Q G^T = T^2 * Qc since Q is isotropic
+        self.Qd = np.zeros((9,9))
+        self.Qd[3:6,3:6] = T*T*var_acc*np.identity(3)
+        self.Qd[6:9,6:9] = T*T*var_gyro*np.identity(3)
+        # Measurement noise covariance matrix for velocity measurements
+        self.R = np.power(0.01,2)*np.identity(3)
+
+        # Recordings padded with zeros to the longest one
+        self.lengths = np.array([imu.shape[0] for imu in imudata])
+        self.K = len(imudata)
+        self.n = int(self.lengths.max())
+        self.imu = np.zeros((self.K, self.n, 6))
+        for i, imu in enumerate(imudata):
+            self.imu[i, :imu.shape[0]] = imu
+        # Marks the samples that belong to a recording
+        self.mask = np.arange(self.n)[None,:] < self.lengths[:,None]
+
+        # Initial attitude of each recording from the average of its first 20 accelerometer samples
+        avg = np.mean(self.imu[:,0:20,0:3], axis=1)
+        roll = np.arctan2(-avg[:,1],-avg[:,2])
+        pitch = np.arctan2(avg[:,0],np.sqrt(avg[:,1]*avg[:,1] + avg[:,2]*avg[:,2]))
+        attitude = np.column_stack((roll, pitch, np.zeros(self.K)))
+        self.x = np.zeros((self.K, self.n, 9))
+        self.q = np.zeros((self.K, self.n, 4))
+        self.x[:,0,6:9] = attitude
+        self.q[:,0] = euler2quat_batch(attitude)
+        self.P = np.zeros((self.K,9,9))
+        self.P[:,0:3,0:3] = np.power(1e-5,2)*np.identity(3)
+        self.P[:,3:6,3:6] = np.power(1e-5,2)*np.identity(3)
+        self.P[:,6:9,6:9] = np.power(0.1*np.pi/180,2)*np.identity(3)
+
+    def SHOE(self, W=5):
+        """
+        Stationary Hypothesis Optimal Estimator (SHOE) over all recordings, with the same non-overlapping
+        windows as Localizer.SHOE. Windows that do not fit in a recording are left at 0.
+
+        :param W: Window size for batch processing
+
+        :returns: (K, n) array of zero-velocity detection statistics
+        """
+        zupt = np.zeros((self.K, self.n))
+        n_win = self.n // W
+        inv_a = (1/self.var_a)
+        inv_w = (1/self.var_w)
+        acc = self.imu[:,:n_win*W,0:3].reshape(self.K,n_win,W,3)
+        gyro = self.imu[:,:n_win*W,3:6].reshape(self.K,n_win,W,3)
+        # Windows that lie completely inside their recording
+        valid = (np.arange(1, n_win+1)*W)[None,:] <= self.lengths[:,None]
+
+        smean_a = np.mean(acc,axis=2)
+        norm = np.linalg.norm(smean_a,axis=2)
+        norm[~valid] = 1 # padding, discarded below
+        g_dir = self.g*smean_a/norm[:,:,None]
+        res_a = acc - g_dir[:,:,None,:]
+        res_a = np.einsum('kijl,kijl->kij', res_a, res_a)
+        res_w = np.einsum('kijl,kijl->kij', gyro, gyro)
+        T = np.zeros((self.K, n_win))
+        for s in range(W):
+            T += inv_a*res_a[:,:,s]
+            T += inv_w*res_w[:,:,s]
+        T[~valid] = 0
+        zupt[:,:n_win*W] = np.repeat(T, W, axis=1)/W
+        return zupt
+
+    def compute_zv_lrt(self, W=5, G=3e8):
+        """Compares likelihoods against a threshold to determine whether zero velocity is detected"""
+        return (self.SHOE(W=W) < G) & self.mask
+
+    def baseline(self, zv):
+        """
+        Runs the EKF over all recordings in lockstep.
+
+        :param zv: (K, n) binary array indicating zero-velocity detection
+
+        :returns: List of K arrays of estimated states, one per recording with its original length
+        """
+        dt = self.T
+        g = np.array([0, 0, self.g])
+        eye3 = np.identity(3)
+        zv = zv & self.mask
+        # Non-zero rows and columns of F - I for every recording
+        N = np.zeros((self.K,6,6))
+        N[:,0:3,0:3] = dt*eye3
+        E = np.zeros((self.K,9,9))
+        R_prev = quat2mat_batch(self.q[:,0])
+
+        for k in range(1, self.n):
+            x_prev = self.x[:,k-1]
+            q_prev = self.q[:,k-1]
+            acc = self.imu[:,k,0:3]
+            gyro = self.imu[:,k,3:6]
+
+            # Quaternion propagation using the small-angle rotation formula, unchanged without rotation
+            norm_w = np.linalg.norm(gyro, axis=1)
+            rotating = norm_w*dt != 0
+            c = np.where(rotating, np.cos(dt*norm_w/2), 1.0)
+            s = np.where(rotating, np.sin(dt*norm_w/2)/np.where(rotating, norm_w, 1.0), 0.0)
+            qw, qx, qy, qz = q_prev.T
+            sx, sy, sz = (s[:,None]*gyro).T
+            q = self.q[:,k]
+            q[:,0] = c*qw - sx*qx - sy*qy - sz*qz
+            q[:,1] = sx*qw + c*qx + sz*qy - sy*qz
+            q[:,2] = sy*qw - sz*qx + c*qy + sx*qz
+            q[:,3] = sz*qw + sy*qx - sx*qy + c*qz
+
+            # Navigation equations
+            Rot = quat2mat_batch(q)
+            acc_n = np.einsum('kij,kj->ki', Rot, acc) + g
+            x = self.x[:,k]
+            x[:,3:6] = x_prev[:,3:6] + dt*acc_n
+            x[:,0:3] = x_prev[:,0:3] + dt*x[:,3:6] + 0.5*dt*dt*acc_n
+            mat2euler_batch(Rot, out=x[:,6:9])
+
+            # Covariance propagation, P + C + C^T with C = M + M N^T/2 and M = N P (see Localizer.propagate_cov)
+            fx, fy, fz = (dt*np.einsum('kij,kj->ki', R_prev, acc)).T
+            S = N[:,3:6,3:6]
+            S[:,0,1] = fz;  S[:,0,2] = -fy
+            S[:,1,0] = -fz; S[:,1,2] = fx
+            S[:,2,0] = fy;  S[:,2,1] = -fx
+            C = np.matmul(N, self.P[:,3:9])
+            C[:,:,0:6] += 0.5*np.matmul(C[:,:,3:9], N.transpose(0,2,1))
+            E[:,0:6] = C
+            self.P += E + E.transpose(0,2,1) + self.Qd
+
+            # Zero-velocity corrections for the recordings with a detection at this sample
+            idx = np.flatnonzero(zv[:,k])
+            if idx.size:
+                P = self.P[idx]
+                L = np.linalg.cholesky(P[:,3:6,3:6] + self.R)
+                # W^T = L^-1 P[3:6,:] and y = L^-1 z from one solve, dx = W y and P = P - W W^T
+                Wy = np.linalg.solve(L, np.concatenate((P[:,3:6,:], -x[idx,3:6,None]), axis=2))
+                WT = Wy[:,:,0:9]
+                dx = np.einsum('mij,mi->mj', WT, Wy[:,:,9])
+                self.P[idx] = P - np.matmul(WT.transpose(0,2,1), WT)
+                x[idx] += dx
+                # Multiply by the small-angle error quaternion and renormalise with positive w
+                hx, hy, hz = 0.5*dx[:,6:9].T
+                qw, qx, qy, qz = q[idx].T
+                qc = np.empty((idx.size,4))
+                qc[:,0] = qw - hx*qx - hy*qy - hz*qz
+                qc[:,1] = qx + qw*hx + hy*qz - hz*qy
+                qc[:,2] = qy + qw*hy + hz*qx - hx*qz
+                qc[:,3] = qz + qw*hz + hx*qy - hy*qx
+                qc /= np.copysign(np.linalg.norm(qc, axis=1), qc[:,0])[:,None]
+                q[idx] = qc
+                Rot[idx] = quat2mat_batch(qc)
+                x[idx,6:9] = mat2euler_batch(Rot[idx])
+
+            R_prev = Rot
+
+        estimates = []
+        for i in range(self.K):
+            x = self.x[i,:self.lengths[i]].copy()
+            x[:,2] = -x[:,2]
+            estimates.append(x)
+        return estimates
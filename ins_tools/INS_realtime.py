@@ -1,5 +1,10 @@
 import numpy as np
-from ins_tools.EKF_realtime import Localizer
+from ins_tools.EKF_realtime import Localizer, FastLocalizer
+from ins_tools.geometry_helpers import quat2mat
+from ins_tools.instrumentation import StageTimer
+
+# Localizer backends selectable when constructing INS
+BACKENDS = {"default": Localizer, "fast": FastLocalizer}
 
 class INS():
     """
@@ -10,13 +15,32 @@ class INS():
     :param sigma_a: Standard deviation of accelerometer noise (default: 0.01)
     :param sigma_w: Standard deviation of gyroscope noise in rad/s (default: 0.01 deg converted to rad)
     :param T: Sampling period in seconds (default: 1/100)
+    :param g: Gravitational acceleration in m/s^2 (default: 9.8029)
+    :param backend: Localizer backend, "default" or "fast" (fused EKF step kernel) (default: "default")
+    :param attitude_correction: How ZUPTs inject the attitude error, "quaternion" (error quaternion) or
+        "matrix" (rotation matrix and eigendecomposition, the original method) (default: "quaternion")
+    :param cov_history: Covariance matrices kept in P for each batch, "full" (every sample), "every"
+        (every cov_every-th sample of the recording) or "latest" (only the last sample, constant memory) (default: "full")
+    :param cov_every: Interval in samples between retained covariance matrices for cov_history="every" (default: 100)
+    :param instrument: Accumulates per-stage timing in a StageTimer, self.timer (default: False)
     """
-    def __init__(self, imudata, sigma_a=0.01, sigma_w=0.01*np.pi/180, T=1.0/100):
+    def __init__(self, imudata, sigma_a=0.01, sigma_w=0.01*np.pi/180, T=1.0/100, g=9.8029, backend="default", attitude_correction="quaternion", cov_history="full", cov_every=100, instrument=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown Localizer backend: {backend}")
+        if attitude_correction not in ("quaternion", "matrix"):
+            raise ValueError(f"Unknown attitude correction: {attitude_correction}")
+        if cov_history not in ("full", "every", "latest"):
+            raise ValueError(f"Unknown covariance history: {cov_history}")
+        if cov_every < 1:
+            raise ValueError(f"Covariance interval must be at least 1: {cov_every}")
         self.config = {
         "sigma_a": sigma_a,
         "sigma_w": sigma_w,
-        "g": 9.8029,
+        "g": g,
         "T": T,
+        "attitude_correction": attitude_correction,
+        "cov_history": cov_history,
+        "cov_every": cov_every,
             }
         # Noise standard deviations
         self.sigma_a = self.config["sigma_a"]
@@ -49,8 +73,16 @@ class INS():
         self.config["H"]= self.H      
 
         # Initialise the Localizer for state estimation
-        self.Localizer = Localizer(self.config, imudata)
+        self.backend = backend
+        self.Localizer = BACKENDS[backend](self.config, imudata)
         self.x_check, self.q, self.P = self.Localizer.getXQP()
+        # Whether push() has estimated the first batch
+        self.started = False
+        # Per-stage timing, the timed methods replace the plain ones only when instrumented
+        self.timer = None
+        if instrument:
+            self.timer = StageTimer()
+            self.timer.instrument(self)
         
     # Performs the core navigation computation
     def baseline(self, imudata, zv, init, G=5e8):
@@ -68,27 +100,71 @@ class INS():
             # Intialises state estimates for this batch
             self.x_check, self.q, self.P = self.Localizer.nextBatch(imudata.shape[0])
 
+        self.zv = zv
+        # Per-sample time steps, passed to push() as a seventh column, otherwise the fixed sampling period
+        timed = imudata.shape[1] > 6
+        if self.backend == "fast":
+            # The fused step kernel fills the batch in place
+            self.Localizer.run(imudata, zv, self.config['T'])
+            self.x = self.x_check.copy()
+            self.x[:,2] = -self.x[:,2]
+            return self.x
+
         x_hat = self.x_check 
         self.x = x_hat.copy()
-        self.zv = zv
+        # Working covariance matrix, updated in place
+        P = self.Localizer.P
         # Skips the first value since Localizer calculated state estimate or the last value of previous batch
         for k in range(1,self.x_check.shape[0]): 
-            dt = self.config['T']
+            dt = imudata[k,6] if timed else self.config['T']
             # State prediction, predict next state based on previous step
             self.x_check[k,:], self.q[k,:],Rot = self.Localizer.nav_eq(self.x_check[k-1,:], imudata[k,:], self.q[k-1,:], dt) #update state through motion model
-            # Compute state transition matrix (F) and process noise mapping matrix (G)
-            F,G = self.Localizer.state_update(imudata[k,:],self.q[k-1,:], dt) 
-            # Update the covariance matrix (P) using the prediction model
-            self.P[k,:,:] = (F.dot(self.P[k-1,:,:])).dot(F.T) + (G.dot(self.Q)).dot(G.T)
-            # Symmetrise the covariance matrix to account for numerical approximations
-            self.P[k,:,:] = (self.P[k,:,:] + self.P[k,:,:].T)/2 
+            # Update the covariance matrix (P) using the prediction model, F and G depend on the
+            # specific force in the navigation frame at the previous attitude
+            f_n = quat2mat(self.q[k-1,:]).dot(imudata[k,0:3])
+            self.Localizer.propagate_cov(P, f_n, dt, P)
             # Corrector step, zero-velocity is detected, the state is corrected using the Kalman update equations
             if self.zv[k] == True: 
-                x_hat[k,:], self.P[k,:,:],self.q[k,:] = self.Localizer.corrector(self.x_check[k,:], self.P[k,:,:], Rot )
+                x_hat[k,:], P, self.q[k,:] = self.Localizer.corrector(self.x_check[k,:], P, Rot, self.q[k,:])
             else:
                 x_hat[k,:] = self.x_check[k,:]
+            # Retains the covariance matrix according to the retention policy
+            self.Localizer.keep_cov(k, P)
             # Store the state estimate for this time step
             self.x[k,:] = x_hat[k,:]  
         self.x[:,2] = -self.x[:,2] 
         return self.x
-    
+
+    def push(self, samples, W=5, G=3e8, flush=False, dt=None):
+        """
+        Streaming front end of the INS. Takes any number of new IMU samples, including single samples,
+        and returns the estimates for the samples that could be processed. Samples that do not complete a
+        zero-velocity detector window and the overlap with the previous batch are kept internally, so
+        the caller only passes new samples and gets back only new rows.
+
+        :param samples: Array of new IMU samples since the previous call
+        :param W: Window size used in the zero-velocity detector
+        :param G: Threshold value for the zero-velocity detector
+        :param flush: Also processes the held back samples, used for the final call
+        :param dt: Time step in seconds before each sample, from the sensor timestamps, instead of the fixed
+            sampling period. Either always or never given for an INS.
+
+        :returns:
+            - **x** (*ndarray*) – Newly estimated states, possibly empty
+            - **zv** (*ndarray*) – Zero-velocity detections of the new states
+        :rtype: tuple (ndarray, ndarray)
+        """
+        if dt is not None:
+            # Held back and batched with the samples as a seventh column
+            samples = np.column_stack((samples[:,0:6], dt))
+        imubatch, zv = self.Localizer.compute_zv_lrt_stream(imudata=samples, W=W, G=G, flush=flush)
+        if imubatch.shape[0] == 0: # No complete window yet
+            return np.zeros((0,9)), zv
+        if not self.started:
+            self.started = True
+            if imubatch.shape[0] != self.x_check.shape[0]:
+                self.x_check, self.q, self.P = self.Localizer.firstBatch(imubatch.shape[0])
+            return self.baseline(imudata=imubatch, zv=zv, init=True), zv
+        x = self.baseline(imudata=imubatch, zv=zv, init=False)
+        # The first row repeats the last estimate of the previous batch
+        return x[1:], zv[1:]
@@ -0,0 +1,116 @@
+import numpy as np
+
+class BatchController():
+    """
+    Chooses the number of new samples the live processing loop waits for before processing a micro-batch,
+    to keep the end-to-end latency of the estimates, from the arrival of a sample until its estimate is
+    stored, under a target.
+
+    The time to process a batch is modelled as a fixed overhead plus a cost per sample, fitted by
+    exponentially weighted least squares over the measured batches. The oldest sample of a batch waits
+    for the batch to fill and then for its processing, so the largest batch meeting the target is
+
+        n = (target - overhead - slack) / (1/rate + cost)
+
+    where slack is the difference between the measured latency and this model, covering the samples held
+    back by the zero-velocity detector and the wake-up delay. It follows increases faster than decreases,
+    so that most batches rather than the average one meet the target. The largest batch also has the
+    lowest processing load. If even that batch keeps the processing thread busy for more than max_load of
+    the time, the batch is enlarged to the size that meets max_load instead, so the GUI is not starved.
+    If no batch size meets max_load, the per-sample cost alone is over budget and the largest batch is
+    used, which spends the least time on the per-batch overhead. The batch size at most doubles from one
+    batch to the next, so a single slow batch cannot stall the estimates for long.
+
+    :param rate: Sampling rate in Hz
+    :param target: Target end-to-end latency in seconds (default: 0.05)
+    :param initial: Batch size until the cost model has been fitted (default: 6)
+    :param max_load: Largest share of time the processing thread may spend processing (default: 0.5)
+    :param min_batch: Smallest batch size (default: 1)
+    :param max_batch: Largest batch size, one second of samples if None
+    :param smoothing: Weight of the latest batch in the model and slack averages (default: 0.1)
+    :param warmup: Number of batches measured before the batch size is adapted (default: 10)
+    """
+    def __init__(self, rate, target=0.05, initial=6, max_load=0.5, min_batch=1, max_batch=None, smoothing=0.1, warmup=10):
+        self.rate = rate
+        self.target = target
+        self.max_load = max_load
+        self.max_batch = max_batch if max_batch is not None else max(int(rate), min_batch)
+        self.min_batch = min_batch
+        self.smoothing = smoothing
+        self.warmup = warmup
+        self.batch = initial
+        self.cost = 0.0 # seconds per sample
+        self.overhead = 0.0 # seconds per batch
+        self.slack = 0.0 # seconds of latency the model does not explain
+        # Exponentially weighted sums of n, t, n^2 and n*t for the least squares fit
+        self.sums = np.zeros(4)
+        self.weight = 0.0
+        self.log = [] # (batch size, processing seconds, latency seconds) per batch
+
+    def fit(self):
+        """Updates the overhead and per-sample cost from the weighted sums."""
+        n, t, nn, nt = self.sums/self.weight
+        var = nn - n*n
+        if var > 1e-9*max(nn, 1.0):
+            self.cost = max((nt - n*t)/var, 0.0)
+            self.overhead = t - self.cost*n
+        if var <= 1e-9*max(nn, 1.0) or self.overhead < 0:
+            # Batches of one size or timing noise, fitted as a cost per sample alone
+            self.cost = nt/nn
+            self.overhead = 0.0
+
+    def update(self, samples, seconds, latency):
+        """
+        Records a processed batch and returns the batch size to wait for next.
+
+        :param samples: Number of new samples in the batch
+        :param seconds: Time spent processing the batch
+        :param latency: Time from the arrival of the oldest unestimated sample until the batch was stored
+
+        :returns: Number of new samples to wait for before the next batch
+        """
+        self.log.append((samples, seconds, latency))
+        if samples == 0:
+            return self.batch
+        a = self.smoothing
+        self.sums = (1 - a)*self.sums + a*np.array([samples, seconds, samples*samples, samples*seconds])
+        self.weight = (1 - a)*self.weight + a
+        self.fit()
+        model = samples/self.rate + self.overhead + self.cost*samples
+        excess = latency - model
+        b = a if excess > self.slack else a/4
+        self.slack = (1 - b)*self.slack + b*excess
+        if len(self.log) < self.warmup:
+            return self.batch
+
+        batch = (self.target - self.overhead - self.slack)/(1/self.rate + self.cost)
+        # Smallest batch whose processing keeps the thread busy at most max_load of the time
+        spare = self.max_load/self.rate - self.cost
+        load_batch = self.overhead/spare if spare > 0 else self.max_batch
+        batch = min(max(batch, load_batch), 2*self.batch)
+        self.batch = int(min(max(batch, self.min_batch), self.max_batch))
+        return self.batch
+
+    def summary(self):
+        """
+        Returns the target and achieved latency and the batch statistics.
+
+        :returns: Dictionary of the target, latency percentiles, share of batches within the target, batch
+            sizes and the fitted cost model
+        """
+        summary = {
+            'target_ms': self.target*1e3,
+            'batches': len(self.log),
+            'batch': self.batch,
+            'cost_us_per_sample': self.cost*1e6,
+            'overhead_us': self.overhead*1e6,
+            'slack_ms': self.slack*1e3,
+        }
+        if self.log:
+            sizes, seconds, latencies = np.array(self.log).T
+            summary['latency_ms'] = {p: float(np.percentile(latencies, q)*1e3) for p, q in (("p50", 50), ("p95", 95), ("max", 100))}
+            summary['within_target'] = float(np.mean(latencies <= self.target))
+            summary['batch_size'] = {p: float(np.percentile(sizes, q)) for p, q in (("p50", 50), ("p95", 95), ("max", 100))}
+            # Share of the time the processing thread was busy
+            summary['load'] = float(seconds.sum()/max(sizes.sum()/self.rate, 1e-9))
+        return summary
@@ -0,0 +1,193 @@
+import numpy as np
+from threading import Condition
+
+class SampleBuffer():
+    """
+    Growable float64 store of fixed-width rows, written by one thread and read by others.
+    Rows are written straight into a preallocated array whose capacity grows in chunks
+    (doubling, at least chunk rows), so appending is O(1) amortized and never converts the history.
+
+    Readers get read-only views of the backing array instead of copies. Rows are never modified once
+    written and growing allocates a new array, so a view handed out earlier stays valid.
+
+    Consumers can block in wait() until enough rows are available instead of polling.
+
+    :param width: Number of values per row
+    :param chunk: Minimum number of rows the capacity grows by (default: 4096)
+    """
+    def __init__(self, width, chunk=4096):
+        self.width = width
+        self.chunk = chunk
+        self.lock = Condition()
+        # Row count a waiting consumer is woken at, None when nobody is waiting
+        self.wake_at = None
+        self.data = np.empty((chunk, width))
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _reserve(self, n):
+        """Grows the backing array to fit n more rows. Must be called with the lock held."""
+        needed = self.length + n
+        if needed > self.data.shape[0]:
+            capacity = max(needed, 2*self.data.shape[0], self.data.shape[0] + self.chunk)
+            data = np.empty((capacity, self.width))
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+
+    def _notify(self):
+        """Wakes a waiting consumer once its row count is reached. Must be called with the lock held."""
+        if self.wake_at is not None and self.length >= self.wake_at:
+            self.wake_at = None
+            self.lock.notify_all()
+
+    def wait(self, count, timeout=None):
+        """
+        Blocks until at least count rows have been written, the timeout expires or wake() is called.
+
+        :param count: Total number of rows to wait for
+        :param timeout: Maximum time to wait in seconds (default: no limit)
+
+        :returns: Number of rows written
+        """
+        with self.lock:
+            if self.length < count:
+                self.wake_at = count
+                self.lock.wait(timeout)
+                self.wake_at = None
+            return self.length
+
+    def wake(self):
+        """Wakes any waiting consumer immediately, e.g. to stop."""
+        with self.lock:
+            self.wake_at = None
+            self.lock.notify_all()
+
+    def append(self, row):
+        """
+        Appends a single row.
+
+        :param row: Sequence of width values
+        """
+        with self.lock:
+            self._reserve(1)
+            self.data[self.length] = row
+            self.length += 1
+            self._notify()
+
+    def extend(self, rows):
+        """
+        Appends several rows at once.
+
+        :param rows: (n, width) array of rows
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.width)
+        with self.lock:
+            self._reserve(rows.shape[0])
+            self.data[self.length:self.length+rows.shape[0]] = rows
+            self.length += rows.shape[0]
+            self._notify()
+
+    def since(self, i):
+        """
+        Returns the rows from index i onwards.
+
+        :param i: Index of the first row
+
+        :returns: Read-only view of the rows
+        """
+        with self.lock:
+            view = self.data[i:self.length]
+        view.flags.writeable = False
+        return view
+
+    def last(self, n):
+        """
+        Returns the latest n rows, or fewer if fewer have been written.
+
+        :param n: Number of rows
+
+        :returns: Read-only view of the rows
+        """
+        with self.lock:
+            view = self.data[max(self.length - n, 0):self.length]
+        view.flags.writeable = False
+        return view
+
+class EstimateStore():
+    """
+    Append-only store of INS state estimates and their zero-velocity flags. Capacity doubles when full,
+    so appending a micro-batch is O(1) amortized instead of copying the whole trajectory.
+    Readers get contiguous read-only views, and the last published index lets a consumer fetch only
+    the rows added since it last asked.
+
+    :param width: Number of values per state estimate (default: 9)
+    :param chunk: Initial capacity in rows (default: 4096)
+    """
+    def __init__(self, width=9, chunk=4096):
+        self.width = width
+        self.lock = Condition()
+        self.estimates = np.empty((chunk, width))
+        self.zv = np.zeros(chunk, dtype=bool)
+        self.length = 0
+        self.published = 0 # Rows already handed out by new_rows()
+
+    def __len__(self):
+        return self.length
+
+    def append(self, estimates, zv):
+        """
+        Appends a batch of estimates.
+
+        :param estimates: (n, width) array of state estimates
+        :param zv: Binary array of n zero-velocity flags
+        """
+        n = estimates.shape[0]
+        with self.lock:
+            needed = self.length + n
+            if needed > self.estimates.shape[0]:
+                capacity = max(needed, 2*self.estimates.shape[0])
+                grown = np.empty((capacity, self.width))
+                grown[:self.length] = self.estimates[:self.length]
+                grown_zv = np.zeros(capacity, dtype=bool)
+                grown_zv[:self.length] = self.zv[:self.length]
+                self.estimates, self.zv = grown, grown_zv
+            self.estimates[self.length:needed] = estimates
+            self.zv[self.length:needed] = zv
+            self.length = needed
+
+    def _views(self, start, stop):
+        """Returns read-only views of rows start to stop. Must be called with the lock held."""
+        estimates = self.estimates[start:stop]
+        zv = self.zv[start:stop]
+        estimates.flags.writeable = False
+        zv.flags.writeable = False
+        return estimates, zv
+
+    def view(self):
+        """
+        Returns all the estimates.
+
+        :returns:
+            - **estimates** (*ndarray*) – Read-only view of the state estimates
+            - **zv** (*ndarray*) – Read-only view of the zero-velocity flags
+        :rtype: tuple (ndarray, ndarray)
+        """
+        with self.lock:
+            return self._views(0, self.length)
+
+    def new_rows(self):
+        """
+        Returns the estimates added since the last call and marks them as published.
+
+        :returns:
+            - **start** (*int*) – Index of the first returned row
+            - **estimates** (*ndarray*) – Read-only view of the new state estimates
+            - **zv** (*ndarray*) – Read-only view of the new zero-velocity flags
+        :rtype: tuple (int, ndarray, ndarray)
+        """
+        with self.lock:
+            start = self.published
+            self.published = self.length
+            return (start,) + self._views(start, self.length)
@@ -129,6 +129,37 @@ def mat2quat(M):
     return q
 
 
+def qmult(q1, q2):
+    ''' Multiply two quaternions
+
+    Parameters
+    ----------
+    q1 : 4 element sequence
+    q2 : 4 element sequence
+
+    Returns
+    -------
+    q12 : shape (4,) array
+
+    Notes
+    -----
+    See : http://en.wikipedia.org/wiki/Quaternions#Hamilton_product
+
+    Examples
+    --------
+    >>> q = qmult([1, 0, 0, 0], [0, 1, 0, 0])
+    >>> np.allclose(q, [0, 1, 0, 0])
+    True
+    '''
+    w1, x1, y1, z1 = q1
+    w2, x2, y2, z2 = q2
+    w = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    x = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    y = w1*y2 + y1*w2 + z1*x2 - x1*z2
+    z = w1*z2 + z1*w2 + x1*y2 - y1*x2
+    return np.array([w, x, y, z])
+
+
 # axis sequences for Euler angles
 _NEXT_AXIS = [1, 2, 0, 1]
 
@@ -389,3 +420,215 @@ def quat2euler(quaternion, axes='sxyz'):
     True
     """
     return mat2euler(quat2mat(quaternion), axes)
+
+
+def _axes_tuple(axes):
+    """Returns the (firstaxis, parity, repetition, frame) tuple for an axis specification"""
+    try:
+        return _AXES2TUPLE[axes.lower()]
+    except (AttributeError, KeyError):
+        _TUPLE2AXES[axes]  # validation
+        return axes
+
+
+def quat2mat_batch(q, out=None):
+    ''' Calculate rotation matrices corresponding to an array of quaternions
+
+    Parameters
+    ----------
+    q : (..., 4) array-like
+      Quaternions in w, x, y, z format
+    out : (..., 3, 3) array, optional
+      Array to write the result to
+
+    Returns
+    -------
+    M : (..., 3, 3) array
+      Rotation matrices, same as applying `quat2mat` to every quaternion
+
+    Examples
+    --------
+    >>> M = quat2mat_batch([[1, 0, 0, 0], [0, 1, 0, 0]])
+    >>> np.allclose(M, [np.eye(3), np.diag([1, -1, -1])])
+    True
+    '''
+    q = np.asarray(q, dtype=np.float64)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    Nq = w*w + x*x + y*y + z*z
+    # s = 0 gives the identity for quaternions too small to normalise
+    small = Nq < _FLOAT_EPS
+    s = np.where(small, 0.0, 2.0/np.where(small, 1.0, Nq))
+    X = x*s
+    Y = y*s
+    Z = z*s
+    wX = w*X; wY = w*Y; wZ = w*Z
+    xX = x*X; xY = x*Y; xZ = x*Z
+    yY = y*Y; yZ = y*Z; zZ = z*Z
+    if out is None:
+        out = np.empty(q.shape[:-1] + (3, 3))
+    out[..., 0, 0] = 1.0-(yY+zZ)
+    out[..., 0, 1] = xY-wZ
+    out[..., 0, 2] = xZ+wY
+    out[..., 1, 0] = xY+wZ
+    out[..., 1, 1] = 1.0-(xX+zZ)
+    out[..., 1, 2] = yZ-wX
+    out[..., 2, 0] = xZ-wY
+    out[..., 2, 1] = yZ+wX
+    out[..., 2, 2] = 1.0-(xX+yY)
+    return out
+
+
+def mat2euler_batch(mat, axes='sxyz', out=None):
+    """Return Euler angles from an array of rotation matrices for specified axis sequence.
+
+    Parameters
+    ----------
+    mat : array-like shape (..., 3, 3) or (..., 4, 4)
+        Rotation matrices or affines.
+    axes : str, optional
+        Axis specification; one of 24 axis sequences as string or encoded
+        tuple - e.g. ``sxyz`` (the default).
+    out : (..., 3) array, optional
+        Array to write the result to
+
+    Returns
+    -------
+    angles : (..., 3) array
+        Rotation angles (according to `axes`), same as applying `mat2euler`
+        to every matrix.
+
+    Examples
+    --------
+    >>> R0 = euler2mat(1, 2, 3, 'syxz')
+    >>> angles = mat2euler_batch([R0, np.eye(3)], 'syxz')
+    >>> np.allclose(angles[0], mat2euler(R0, 'syxz'))
+    True
+    """
+    firstaxis, parity, repetition, frame = _axes_tuple(axes)
+
+    i = firstaxis
+    j = _NEXT_AXIS[i+parity]
+    k = _NEXT_AXIS[i-parity+1]
+
+    M = np.asarray(mat, dtype=np.float64)[..., :3, :3]
+    if repetition:
+        sy = np.sqrt(M[..., i, j]*M[..., i, j] + M[..., i, k]*M[..., i, k])
+        regular = sy > _EPS4
+        ax = np.where(regular, np.arctan2(M[..., i, j], M[..., i, k]), np.arctan2(-M[..., j, k], M[..., j, j]))
+        ay = np.arctan2(sy, M[..., i, i])
+        az = np.where(regular, np.arctan2(M[..., j, i], -M[..., k, i]), 0.0)
+    else:
+        cy = np.sqrt(M[..., i, i]*M[..., i, i] + M[..., j, i]*M[..., j, i])
+        regular = cy > _EPS4
+        ax = np.where(regular, np.arctan2(M[..., k, j], M[..., k, k]), np.arctan2(-M[..., j, k], M[..., j, j]))
+        ay = np.arctan2(-M[..., k, i], cy)
+        az = np.where(regular, np.arctan2(M[..., j, i], M[..., i, i]), 0.0)
+
+    if parity:
+        ax, ay, az = -ax, -ay, -az
+    if frame:
+        ax, az = az, ax
+    if out is None:
+        out = np.empty(M.shape[:-2] + (3,))
+    out[..., 0] = ax
+    out[..., 1] = ay
+    out[..., 2] = az
+    return out
+
+
+def quat2euler_batch(q, axes='sxyz', out=None):
+    """Euler angles from an array of quaternions for specified axis sequence `axes`
+
+    Parameters
+    ----------
+    q : (..., 4) array-like
+       w, x, y, z of the quaternions
+    axes : str, optional
+        Axis specification; one of 24 axis sequences as string or encoded
+        tuple - e.g. ``sxyz`` (the default).
+    out : (..., 3) array, optional
+        Array to write the result to
+
+    Returns
+    -------
+    angles : (..., 3) array
+        Rotation angles (according to `axes`), same as applying `quat2euler`
+        to every quaternion.
+
+    Examples
+    --------
+    >>> angles = quat2euler_batch([[0.99810947, 0.06146124, 0, 0]])
+    >>> np.allclose(angles, [[0.123, 0, 0]])
+    True
+    """
+    return mat2euler_batch(quat2mat_batch(q), axes, out)
+
+
+def euler2quat_batch(angles, axes='sxyz', out=None):
+    """Return quaternions from an array of Euler angles and axis sequence `axes`
+
+    Parameters
+    ----------
+    angles : (..., 3) array-like
+        First, second and third rotation angles (according to `axes`).
+    axes : str, optional
+        Axis specification; one of 24 axis sequences as string or encoded
+        tuple - e.g. ``sxyz`` (the default).
+    out : (..., 4) array, optional
+        Array to write the result to
+
+    Returns
+    -------
+    quat : (..., 4) array
+       Quaternions in w, x, y z (real, then vector) format, same as applying
+       `euler2quat` to every set of angles.
+
+    Examples
+    --------
+    >>> q = euler2quat_batch([[1, 2, 3]], 'ryxz')
+    >>> np.allclose(q, [[0.435953, 0.310622, -0.718287, 0.444435]])
+    True
+    """
+    firstaxis, parity, repetition, frame = _axes_tuple(axes)
+
+    i = firstaxis + 1
+    j = _NEXT_AXIS[i+parity-1] + 1
+    k = _NEXT_AXIS[i-parity] + 1
+
+    angles = np.asarray(angles, dtype=np.float64)
+    ai, aj, ak = angles[..., 0], angles[..., 1], angles[..., 2]
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        aj = -aj
+
+    ai = ai/2.0
+    aj = aj/2.0
+    ak = ak/2.0
+    ci = np.cos(ai)
+    si = np.sin(ai)
+    cj = np.cos(aj)
+    sj = np.sin(aj)
+    ck = np.cos(ak)
+    sk = np.sin(ak)
+    cc = ci*ck
+    cs = ci*sk
+    sc = si*ck
+    ss = si*sk
+
+    if out is None:
+        out = np.empty(angles.shape[:-1] + (4,))
+    if repetition:
+        out[..., 0] = cj*(cc - ss)
+        out[..., i] = cj*(cs + sc)
+        out[..., j] = sj*(cc + ss)
+        out[..., k] = sj*(cs - sc)
+    else:
+        out[..., 0] = cj*cc + sj*ss
+        out[..., i] = cj*sc - sj*cs
+        out[..., j] = cj*ss + sj*cc
+        out[..., k] = cj*cs - sj*sc
+    if parity:
+        out[..., j] *= -1.0
+
+    return out
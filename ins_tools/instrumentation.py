@@ -0,0 +1,120 @@
+import numpy as np
+import time
+import json
+
+class StageTimer():
+    """
+    Accumulates wall time and call counts per processing stage of an INS, along with ZUPT and
+    non-ZUPT sample counts and the timing of every batch.
+
+    Stages are measured by replacing the INS and Localizer methods with timed wrappers once, when
+    instrument() is called, so an INS without a StageTimer runs the unmodified code.
+
+    Stages:
+        - **detection** – zero-velocity detection (compute_zv_lrt and compute_zv_lrt_stream)
+        - **prediction** – navigation equations (nav_eq), or for the fast backend the fused step minus
+          the covariance and ZUPT stages
+        - **covariance** – covariance propagation (propagate_cov)
+        - **zupt** – ZUPT correction (corrector, or zupt_update for the fast backend)
+        - **step** – fused EKF step of the fast backend, includes the previous three
+
+    Batches are timed over the whole INS.baseline call.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.samples = 0
+        self.zupt_samples = 0
+        self.batches = [] # (samples, seconds) per batch
+
+    def wrap(self, obj, name, stage):
+        """
+        Replaces a method of an object with a version that adds its wall time to a stage.
+
+        :param obj: Object whose method is timed
+        :param name: Name of the method
+        :param stage: Name of the stage
+        """
+        fn = getattr(obj, name)
+        entry = self.stages.setdefault(stage, [0.0, 0])
+        perf_counter = time.perf_counter
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            result = fn(*args, **kwargs)
+            entry[0] += perf_counter() - start
+            entry[1] += 1
+            return result
+        setattr(obj, name, timed)
+
+    def instrument(self, ins):
+        """
+        Times the stages of an INS and its Localizer.
+
+        :param ins: INS to instrument
+        """
+        loc = ins.Localizer
+        self.wrap(loc, 'compute_zv_lrt', 'detection')
+        self.wrap(loc, 'compute_zv_lrt_stream', 'detection')
+        self.wrap(loc, 'propagate_cov', 'covariance')
+        if ins.backend == "fast":
+            self.wrap(loc, 'zupt_update', 'zupt')
+            self.wrap(loc, 'step', 'step')
+        else:
+            self.wrap(loc, 'nav_eq', 'prediction')
+            self.wrap(loc, 'corrector', 'zupt')
+
+        baseline = ins.baseline
+        perf_counter = time.perf_counter
+        def timed_baseline(imudata, zv, init, *args, **kwargs):
+            start = perf_counter()
+            result = baseline(imudata, zv, init, *args, **kwargs)
+            self.batches.append((imudata.shape[0] - 1, perf_counter() - start))
+            # The first sample of a batch holds the initial or carried over state and is not processed
+            self.samples += imudata.shape[0] - 1
+            self.zupt_samples += int(np.count_nonzero(zv[1:]))
+            return result
+        ins.baseline = timed_baseline
+
+    def summary(self):
+        """
+        Returns the accumulated statistics.
+
+        :returns: Dictionary of per-stage times and call counts, sample counts and batch timing percentiles
+        """
+        stages = {stage: list(entry) for stage, entry in self.stages.items()}
+        if 'step' in stages:
+            # The fused step includes the covariance and ZUPT stages
+            prediction = stages['step'][0] - stages.get('covariance', [0.0])[0] - stages.get('zupt', [0.0])[0]
+            stages['prediction'] = [prediction, stages['step'][1]]
+        batch_times = np.array([seconds for _, seconds in self.batches])
+        summary = {
+            'stages': {stage: {'time_s': seconds, 'calls': calls, 'mean_us': seconds/calls*1e6 if calls else 0.0}
+                       for stage, (seconds, calls) in stages.items()},
+            'samples': self.samples,
+            'zupt_samples': self.zupt_samples,
+            'non_zupt_samples': self.samples - self.zupt_samples,
+            'batches': len(self.batches),
+            'batch_time_s': float(batch_times.sum()),
+        }
+        if len(batch_times):
+            summary['batch_ms'] = {p: float(np.percentile(batch_times, q)*1e3) for p, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+        return summary
+
+    def report(self):
+        """Prints the per-stage times and sample counts."""
+        summary = self.summary()
+        print(f"Samples: {summary['samples']} ({summary['zupt_samples']} ZUPT, {summary['non_zupt_samples']} non-ZUPT) in {summary['batches']} batches")
+        for stage, entry in summary['stages'].items():
+            print(f"{stage}: {entry['time_s']*1e3:.1f} ms over {entry['calls']} calls ({entry['mean_us']:.2f} us per call)")
+
+    def save(self, path, **extra):
+        """
+        Writes the statistics and the timing of every batch to a JSON file.
+
+        :param path: Output file path
+        :param extra: Additional entries written alongside the statistics
+        """
+        summary = self.summary()
+        summary.update(extra)
+        summary['batch_log'] = [[samples, seconds] for samples, seconds in self.batches]
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
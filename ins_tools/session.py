@@ -0,0 +1,169 @@
+import numpy as np
+import os
+import json
+import time
+from threading import Thread, Event
+from ins_tools.storage import save_table
+
+# A session directory holds one binary file per table, raw IMU samples, their time steps and packet
+# counters and SampleTimeFine timestamps, state estimates and ZUPT flags, appended in fixed-size chunks, and index.json with the number of rows safely on disk in each file.
+# The index is only updated after the data it describes has been flushed, so after a crash the session
+# reopens with everything up to the last flush.
+TABLES = {
+    'raw': {'file': 'raw.bin', 'dtype': '<f8', 'width': 6},
+    'timestamps': {'file': 'timestamps.bin', 'dtype': '<f8', 'width': 3},
+    'estimates': {'file': 'estimates.bin', 'dtype': '<f8', 'width': 9},
+    'zv': {'file': 'zv.bin', 'dtype': 'u1', 'width': 1},
+}
+
+class SessionWriter(Thread):
+    """
+    Background thread that appends the raw IMU samples, estimates and ZUPT flags of a live session to disk
+    while recording. New rows are read from the sample buffer and estimate store without copying them
+    and written once a full chunk is available, with the files flushed and the index updated at every
+    flush interval. Stopping only writes the last partial chunks and marks the session complete.
+
+    :param directory: Session directory
+    :param samples: SampleBuffer of raw IMU samples
+    :param store: EstimateStore of estimates and ZUPT flags
+    :param chunk: Number of rows written at a time (default: 256)
+    :param flush_interval: Seconds between flushes to disk (default: 1.0)
+    :param metadata: Extra entries saved in the index, e.g. the CSV export paths
+    :param timestamps: SampleBuffer of the time step, packet counter and SampleTimeFine of each raw sample, in
+        its first three columns, appended before the sample itself
+    """
+    def __init__(self, directory, samples, store, chunk=256, flush_interval=1.0, metadata=None, timestamps=None):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.samples = samples
+        self.timestamps = timestamps
+        self.store = store
+        self.chunk = chunk
+        self.flush_interval = flush_interval
+        self.stopping = Event()
+        os.makedirs(directory, exist_ok=True)
+        self.files = {name: open(os.path.join(directory, table['file']), 'wb') for name, table in TABLES.items()}
+        self.rows = {name: 0 for name in TABLES}
+        self.index = {
+            'version': 1,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'complete': False,
+            'chunk': chunk,
+            'tables': TABLES,
+        }
+        self.index.update(metadata or {})
+        self.write_index()
+
+    def run(self):
+        """Writes full chunks until stopped, then the remaining rows."""
+        while not self.stopping.wait(self.flush_interval):
+            self.write(final=False)
+        self.write(final=True)
+
+    def finalize(self, stats=None, complete=True):
+        """
+        Stops the thread once everything recorded is on disk and records whether it is complete.
+
+        :param stats: Session statistics saved in the index, e.g. the backlog and packet gaps of the processing loop
+        :param complete: Marks the session complete, False for a session cut short by an error
+        """
+        self.stopping.set()
+        self.join()
+        for f in self.files.values():
+            f.close()
+        self.index['complete'] = complete
+        if stats is not None:
+            self.index['stats'] = stats
+        self.write_index()
+
+    def append(self, name, rows):
+        """Appends rows to a table file. The caller flushes."""
+        self.files[name].write(np.ascontiguousarray(rows, dtype=TABLES[name]['dtype']).data)
+        self.rows[name] += rows.shape[0]
+
+    def write(self, final):
+        """
+        Writes the new rows, in whole chunks unless final, flushes the files and updates the index.
+
+        :param final: Also writes the rows of the last partial chunk
+        """
+        def count(available):
+            return available if final else available - available % self.chunk
+
+        raw = self.samples.since(self.rows['raw'])
+        n = count(raw.shape[0])
+        if n:
+            self.append('raw', raw[:n])
+            # Same rows as the raw samples, whose timestamps are always appended first
+            if self.timestamps is not None:
+                self.append('timestamps', self.timestamps.since(self.rows['timestamps'])[:n, 0:3])
+        estimates, zv = self.store.view()
+        n = count(estimates.shape[0] - self.rows['estimates'])
+        if n:
+            start = self.rows['estimates']
+            self.append('estimates', estimates[start:start+n])
+            self.append('zv', zv[start:start+n])
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.write_index()
+
+    def write_index(self):
+        """Atomically replaces index.json with the current row and chunk counts."""
+        self.index['rows'] = dict(self.rows)
+        # Rows are written in whole chunks, only the last chunk of a finalized session can be partial
+        self.index['chunks'] = {name: -(-rows // self.chunk) for name, rows in self.rows.items()}
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+def load_session(directory):
+    """
+    Reopens a recorded session by memory-mapping its files up to the rows recorded in its index.
+
+    :param directory: Session directory
+
+    :returns:
+        - **index** (*dict*) – Session index
+        - **raw** (*ndarray*) – Raw IMU samples
+        - **timestamps** (*ndarray*) – Time step in seconds, packet counter and SampleTimeFine of each raw sample,
+          None for sessions recorded without them
+        - **estimates** (*ndarray*) – State estimates
+        - **zv** (*ndarray*) – Zero-velocity flags
+    :rtype: tuple (dict, ndarray, ndarray, ndarray, ndarray)
+    """
+    with open(os.path.join(directory, 'index.json')) as f:
+        index = json.load(f)
+    arrays = {}
+    for name, table in index['tables'].items():
+        rows = index['rows'][name]
+        shape = (rows, table['width'])
+        if rows == 0:
+            arrays[name] = np.zeros(shape, dtype=table['dtype'])
+        else:
+            arrays[name] = np.memmap(os.path.join(directory, table['file']), dtype=table['dtype'], mode='r', shape=shape)
+    timestamps = arrays.get('timestamps')
+    if timestamps is not None and timestamps.shape[0] != arrays['raw'].shape[0]:
+        timestamps = None
+    return index, arrays['raw'], timestamps, arrays['estimates'], arrays['zv'][:,0].astype(bool)
+
+def export_session(directory):
+    """
+    Exports a recorded session to the raw data and estimates CSV files named in its index. The time step,
+    packet counter and SampleTimeFine of each sample follow the IMU values in the raw data, if recorded.
+
+    :param directory: Session directory
+
+    :returns: Paths of the raw data and estimates CSV files
+    """
+    index, raw, timestamps, estimates, zv = load_session(directory)
+    if timestamps is not None:
+        save_table(index['raw_path'], np.column_stack((raw, timestamps)), header="AccX,AccY,AccZ,GyrX,GyrY,GyrZ,dt,PacketCounter,SampleTimeFine",
+            fmt="%.18e,%.18e,%.18e,%.18e,%.18e,%.18e,%.18e,%d,%d")
+    else:
+        save_table(index['raw_path'], raw, header="AccX,AccY,AccZ,GyrX,GyrY,GyrZ")
+    # Position and velocity estimates and stationary detections
+    combined = np.column_stack((estimates[:,0:6], zv.astype(int)))
+    save_table(index['estimates_path'], combined, header="x,y,z,vx,vy,vz,zv", fmt="%.15g,%.15g,%.15g,%.15g,%.15g,%.15g,%d")
+    return index['raw_path'], index['estimates_path']
@@ -0,0 +1,86 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+class SharedRing():
+    """
+    Ring buffer of rows in shared memory, appended to by one process and read by others without
+    copying or pickling. The first 8 bytes hold a sequence counter, the number of rows ever written,
+    which is only increased after the rows are in place.
+
+    Every row is stored twice, capacity rows apart, so that any range of up to capacity consecutive
+    rows is contiguous and readers get a single view of it. A reader that falls more than capacity
+    rows behind loses the oldest rows.
+
+    :param width: Number of values per row
+    :param capacity: Number of rows kept (default: 65536)
+    :param dtype: Data type of the values (default: float64)
+    :param name: Name of an existing ring to attach to, creates a new one if None
+    """
+    def __init__(self, width, capacity=65536, dtype=np.float64, name=None):
+        self.width = width
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        size = 8 + 2*capacity*width*self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((2*capacity, width), dtype=self.dtype, buffer=self.shm.buf, offset=8)
+        if name is None:
+            self.counter[0] = 0
+
+    @property
+    def name(self):
+        """Name other processes attach to the ring with."""
+        return self.shm.name
+
+    def __len__(self):
+        return int(self.counter[0])
+
+    def append(self, rows):
+        """
+        Appends rows, only the last capacity rows if there are more.
+
+        :param rows: (n, width) array of rows
+        """
+        rows = np.asarray(rows).reshape(-1, self.width)
+        n = rows.shape[0]
+        if n == 0:
+            return
+        count = int(self.counter[0])
+        kept = min(n, self.capacity)
+        index = (count + n - kept + np.arange(kept)) % self.capacity
+        self.data[index] = rows[n-kept:]
+        self.data[index + self.capacity] = rows[n-kept:]
+        # Published only once both copies are written
+        self.counter[0] = count + n
+
+    def since(self, i, n=None):
+        """
+        Returns the rows from index i onwards, at most the latest n of them.
+
+        :param i: Index of the first row
+        :param n: Maximum number of rows, the capacity if None
+
+        :returns:
+            - **start** (*int*) – Index of the first returned row, later than i if older rows were lost or not requested
+            - **rows** (*ndarray*) – Read-only view of the rows
+        :rtype: tuple (int, ndarray)
+        """
+        count = int(self.counter[0])
+        limit = self.capacity if n is None else min(n, self.capacity)
+        start = min(max(i, count - limit), count)
+        offset = start % self.capacity
+        rows = self.data[offset:offset + count - start]
+        rows.flags.writeable = False
+        return start, rows
+
+    def close(self, unlink=False):
+        """
+        Detaches from the ring. Views returned by since() must no longer be in use.
+
+        :param unlink: Also frees the shared memory, done by the process that created it
+        """
+        if unlink:
+            self.shm.unlink()
+        self.counter = None
+        self.data = None
+        self.shm.close()
@@ -0,0 +1,113 @@
+import numpy as np
+import os
+
+# Raw IMU data and estimates are CSV tables with a header row. Each can have a binary copy, a .npy
+# file with the same name holding the table as a float64 array, which loads by memory-mapping instead
+# of parsing text. The CSV file stays the reference: a binary copy older than its CSV file is ignored.
+
+def binary_path(path):
+    """Returns the path of the binary copy of a CSV table."""
+    return os.path.splitext(path)[0] + '.npy'
+
+def csv_path(path):
+    """Returns the path of the CSV table of a binary copy."""
+    return os.path.splitext(path)[0] + '.csv'
+
+def has_binary(path):
+    """Returns whether a CSV table has an up to date binary copy."""
+    npy = binary_path(path)
+    if not os.path.exists(npy):
+        return False
+    return not os.path.exists(path) or os.path.getmtime(npy) >= os.path.getmtime(path)
+
+def load_table(path, mmap=True):
+    """
+    Loads a table, from its binary copy if there is an up to date one and from the CSV file otherwise.
+
+    :param path: Path of the CSV table
+    :param mmap: Memory-maps the binary copy read-only instead of reading it into memory
+
+    :returns: 2D array of the table without its header
+    """
+    if has_binary(path):
+        return np.load(binary_path(path), mmap_mode='r' if mmap else None)
+    return np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+
+def load_imu(path, T=1.0/100):
+    """
+    Loads a raw IMU data table with its sampling period. Recordings exported from a session have the time
+    step of each sample after the accelerometer and gyroscope values, older ones are sampled at T.
+
+    :param path: Path of the CSV table
+    :param T: Sampling period in seconds of recordings without time steps
+
+    :returns:
+        - **imu** (*ndarray*) – Accelerometer and gyroscope values, followed by the time step of each sample if recorded
+        - **T** (*float*) – Sampling period in seconds, the median time step if recorded
+    :rtype: tuple (ndarray, float)
+    """
+    data = load_table(path)
+    if data.shape[1] > 6:
+        return data[:, 0:7], float(np.median(data[:, 6]))
+    return data, T
+
+def window_size(T, duration=0.05, minimum=5):
+    """
+    Zero-velocity detector window for a sampling period, the same length of time at any sampling rate,
+    used by both the live and offline pipelines.
+
+    :param T: Sampling period in seconds
+    :param duration: Length of the window in seconds (default: 0.05, 5 samples at 100 Hz)
+    :param minimum: Smallest number of samples (default: 5)
+
+    :returns: Window size in samples
+    """
+    return max(minimum, round(duration/T))
+
+def save_table(path, data, header, fmt='%.18e', csv=True):
+    """
+    Saves a table as a binary copy and optionally as a CSV file. With the CSV file, the binary copy holds
+    the values as written in it, rounded to fmt, so both load the same numbers.
+
+    :param path: Path of the CSV table
+    :param data: 2D array of the table
+    :param header: Comma separated column names of the CSV file
+    :param fmt: Number format of the CSV file
+    :param csv: Also writes the CSV file
+    """
+    data = np.asarray(data, dtype=float)
+    if csv:
+        np.savetxt(path, data, delimiter=",", header=header, comments='', fmt=fmt)
+        # Read back like convert_csv, the CSV file is the reference
+        data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    # Written after the CSV file so it counts as up to date
+    np.save(binary_path(path), data)
+
+def convert_csv(path, force=False):
+    """
+    Writes the binary copy of a CSV table.
+
+    :param path: Path of the CSV table
+    :param force: Converts even if the binary copy is up to date
+
+    :returns: Whether the table was converted
+    """
+    if not force and has_binary(path):
+        return False
+    data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    np.save(binary_path(path), data)
+    return True
+
+def list_tables(directory):
+    """
+    Lists the tables in a directory, whether stored as CSV files, binary copies or both.
+
+    :param directory: Directory to list
+
+    :returns: Sorted list of table file names, with the .csv extension
+    """
+    names = set()
+    for filename in os.listdir(directory):
+        if filename.endswith('.csv') or filename.endswith('.npy'):
+            names.add(csv_path(filename))
+    return sorted(names)
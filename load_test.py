@@ -0,0 +1,80 @@
+import numpy as np
+import argparse
+import threading
+import time
+import json
+from receive import Receive
+from sources import ReplaySource
+
+def run_rate(path, rate, packet, duration=10, interval=0.01, target_latency=0.05):
+    """
+    Runs the live pipeline on a recording replayed at a given rate, sampling its processing backlog.
+
+    :param path: Raw IMU data CSV file
+    :param rate: Sampling rate of the replay in Hz
+    :param packet: Number of samples the replay delivers at a time
+    :param duration: Seconds after which recording is stopped, if the recording has not ended before
+    :param interval: Seconds between backlog samples
+    :param target_latency: Target latency of the adaptive batch sizing in seconds, None for fixed batches
+
+    :returns: Dictionary of the sample count, wall time, throughput and backlog statistics
+    """
+    rec = Receive(source=ReplaySource(path, rate, packet), save_graphs=False, target_latency=target_latency)
+    thread = threading.Thread(target=rec.main, args=('hallway', 'walk', f'loadtest_{rate:g}'))
+    start = time.perf_counter()
+    thread.start()
+    backlogs = []
+    while thread.is_alive():
+        if rec.getRunning() and rec.ins is not None:
+            backlogs.append(rec.getBacklog())
+        if time.perf_counter() - start > duration:
+            rec.setStop(True)
+        time.sleep(interval)
+    thread.join()
+    wall = time.perf_counter() - start
+    backlogs = np.array(backlogs) if backlogs else np.zeros(1)
+    samples = rec.callback.getLengthData()
+    return {
+        'rate_hz': rate,
+        'packet': packet,
+        'samples': samples,
+        'wall_time_s': wall,
+        'samples_per_s': samples/wall,
+        'backlog_p95': float(np.percentile(backlogs, 95)),
+        'backlog_max': int(backlogs.max()),
+        # Time the processing lagged behind the sensor at most
+        'max_lag_s': float(backlogs.max()/rate),
+        'loop': rec.loop_stats,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the maximum input rate the live pipeline sustains by replaying a recording through it at increasing rates.")
+    parser.add_argument("--file", default="data/hallway/walk/trial1.csv", help="Raw IMU data CSV file to replay")
+    parser.add_argument("--rates", default="100,250,500,1000,2000,4000", help="Comma separated sampling rates in Hz")
+    parser.add_argument("--packet", type=int, default=1, help="Number of samples the replay delivers at a time")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds each rate is run for at most")
+    parser.add_argument("--max-lag", type=float, default=0.5, help="Largest lag behind the sensor in seconds for a rate to count as sustained, along with processing at least 95%% of the rate")
+    parser.add_argument("--target-latency", type=float, default=0.05, help="Target latency of the adaptive batch sizing in seconds, 0 for fixed batches")
+    parser.add_argument("--json", default=None, help="Writes the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for rate in (float(r) for r in args.rates.split(',')):
+        result = run_rate(args.file, rate, args.packet, args.duration, target_latency=args.target_latency or None)
+        # Keeping up on average and never lagging too far behind
+        result['sustained'] = result['samples_per_s'] >= 0.95*rate and result['max_lag_s'] <= args.max_lag
+        results.append(result)
+
+    print()
+    print(f"{'Rate (Hz)':>10} {'Samples/s':>10} {'Backlog p95':>12} {'Backlog max':>12} {'Max lag (s)':>12}  Sustained")
+    for result in results:
+        print(f"{result['rate_hz']:>10g} {result['samples_per_s']:>10.0f} {result['backlog_p95']:>12.0f} {result['backlog_max']:>12d} {result['max_lag_s']:>12.3f}  {'yes' if result['sustained'] else 'no'}")
+    sustained = [result['rate_hz'] for result in results if result['sustained']]
+    print("Maximum sustained rate: " + (f"{max(sustained):g} Hz" if sustained else "none"))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written to: " + args.json)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
-from PyQt6.QtCore import QSize, QTimer, QRunnable, pyqtSlot, QThreadPool, Qt
-from PyQt6.QtWidgets import QApplication, QMainWindow, QPushButton, QHBoxLayout, QVBoxLayout, QWidget, QGridLayout, QLabel, QLineEdit
+from PyQt6.QtCore import QSize, QTimer, QRunnable, pyqtSlot, pyqtSignal, QThreadPool, Qt
+from PyQt6.QtWidgets import QApplication, QMainWindow, QPushButton, QHBoxLayout, QVBoxLayout, QWidget, QGridLayout, QLabel, QLineEdit, QCheckBox
 import pyqtgraph as pg
 import numpy as np
-from receive import Receive
+from receive import Receive, ProcessReceive
+from ins_tools.session import export_session
+from sources import ReplaySource, XsensSource
+from tools import path_significance, thin_points
+from collections import deque
 import warnings
+import time
+import json
+import argparse
+import os
 warnings.simplefilter("ignore", UserWarning)
 
-# Testing graph updates
-import time #
-import matplotlib.pyplot as plt #
-
 pg.setConfigOption('background', 'white')
 
 class CustomPlotWidget(pg.PlotWidget):
@@ -31,6 +35,259 @@ class CustomPlotWidget(pg.PlotWidget):
         self.showGrid(x=True, y=True, alpha=0.5)
         self.addLegend(labelTextColor='k')
 
+class TrajectoryPlot():
+    """
+    Top-down trajectory and zero-velocity markers drawn incrementally, so the cost of a frame does not
+    grow with the length of the session.
+
+    The trajectory is split into segments of a fixed number of points. Only the last, live segment is
+    redrawn when new estimates arrive. A finished segment is drawn reduced with Douglas-Peucker to about
+    one pixel at the current zoom, and is only reduced again when the zoom changes by more than a factor 2.
+    Zero-velocity markers are chunked the same way, skipping those within marker_spacing of the previous
+    marker. The markers of a finished segment are thinned to marker_pixels apart at the current zoom, and
+    all finished markers are drawn by one item, only updated when a segment finishes or the zoom changes.
+
+    :param plot_widget: PlotWidget the trajectory is drawn in
+    :param pen: Pen of the trajectory
+    :param marker_pen: Pen of the zero-velocity markers
+    :param segment: Number of points per segment (default: 1000)
+    :param marker_spacing: Minimum distance in metres between consecutive markers (default: 0.01)
+    :param marker_pixels: Minimum distance in pixels between the markers of finished segments (default: 5)
+    """
+    def __init__(self, plot_widget, pen, marker_pen, segment=1000, marker_spacing=0.01, marker_pixels=5):
+        self.plot_widget = plot_widget
+        self.pen = pen
+        self.segment = segment
+        self.marker_spacing = marker_spacing
+        self.marker_pixels = marker_pixels
+        self.finished = [] # (item, x, y, significance) per finished segment
+        self.finished_markers = [] # (x, y, thinned x, thinned y) per finished segment
+        self.tolerance = None # Tolerance the finished segments are reduced with
+        # Live segment, the first point is the last point of the previous segment
+        self.x = np.empty(segment + 1)
+        self.y = np.empty(segment + 1)
+        self.live_length = 0
+        self.live = plot_widget.plot([], [], pen=pen, name="Trajectory")
+        # Markers of the live segment, at most one per point
+        self.marker_x = np.empty(segment + 1)
+        self.marker_y = np.empty(segment + 1)
+        self.marker_length = 0
+        self.markers = pg.ScatterPlotItem(pen=marker_pen, symbol='o')
+        plot_widget.addItem(self.markers)
+        self.finished_marker_item = pg.ScatterPlotItem(pen=marker_pen, symbol='o')
+        plot_widget.addItem(self.finished_marker_item)
+        plot_widget.getViewBox().sigRangeChanged.connect(lambda *args: self.updateDetail())
+        self.last_marker = None
+        self.count = 0 # Number of estimates drawn
+
+    def clear(self):
+        """Removes the trajectory and markers."""
+        for item, _, _, _ in self.finished:
+            self.plot_widget.removeItem(item)
+        self.finished_marker_item.clear()
+        self.finished = []
+        self.finished_markers = []
+        self.tolerance = None
+        self.live_length = 0
+        self.live.setData([], [])
+        self.marker_length = 0
+        self.markers.clear()
+        self.last_marker = None
+        self.count = 0
+
+    def pixelTolerance(self):
+        """Returns the size of a pixel in metres at the current zoom."""
+        width, height = self.plot_widget.getViewBox().viewPixelSize()
+        return max(width, height)
+
+    def append(self, estimates, zv):
+        """
+        Adds new estimates to the trajectory.
+
+        :param estimates: Array of new estimated states from the INS
+        :param zv: Zero velocity detection flags of the new estimates
+        """
+        if estimates.shape[0] == 0:
+            return
+        self.count += estimates.shape[0]
+        x = -estimates[:, 0]
+        y = estimates[:, 1]
+        markers = self.marker_length
+        i = 0
+        while i < len(x):
+            n = min(len(x) - i, self.x.shape[0] - self.live_length)
+            self.x[self.live_length:self.live_length+n] = x[i:i+n]
+            self.y[self.live_length:self.live_length+n] = y[i:i+n]
+            self.live_length += n
+            stationary = zv[i:i+n]
+            self.appendMarkers(x[i:i+n][stationary], y[i:i+n][stationary])
+            i += n
+            if self.live_length == self.x.shape[0]:
+                self.finishSegment()
+                markers = -1
+        self.live.setData(self.x[:self.live_length], self.y[:self.live_length])
+        # Only the live markers are redrawn
+        if self.marker_length != markers:
+            self.markers.setData(self.marker_x[:self.marker_length], self.marker_y[:self.marker_length])
+
+    def appendMarkers(self, x, y):
+        """Adds zero-velocity markers to the live segment, skipping those close to the previous marker."""
+        for i in range(len(x)):
+            if self.last_marker is None or np.hypot(x[i] - self.last_marker[0], y[i] - self.last_marker[1]) >= self.marker_spacing:
+                self.marker_x[self.marker_length] = x[i]
+                self.marker_y[self.marker_length] = y[i]
+                self.marker_length += 1
+                self.last_marker = (x[i], y[i])
+
+    def markerSpacing(self):
+        """Returns the minimum distance in metres between the markers of finished segments at the current tolerance."""
+        return max(self.marker_spacing, self.marker_pixels*self.tolerance)
+
+    def finishSegment(self):
+        """Moves the full live segment to its own reduced plot item and starts a new one at its last point."""
+        x = self.x.copy()
+        y = self.y.copy()
+        significance = path_significance(x, y)
+        if self.tolerance is None:
+            self.tolerance = self.pixelTolerance()
+        keep = np.flatnonzero(significance > self.tolerance)
+        item = self.plot_widget.plot(x[keep], y[keep], pen=self.pen)
+        self.finished.append((item, x, y, significance))
+        self.x[0] = x[-1]
+        self.y[0] = y[-1]
+        self.live_length = 1
+        # The markers of the segment are thinned once and move to the finished markers
+        marker_x = self.marker_x[:self.marker_length].copy()
+        marker_y = self.marker_y[:self.marker_length].copy()
+        keep = thin_points(marker_x, marker_y, self.markerSpacing())
+        self.finished_markers.append((marker_x, marker_y, marker_x[keep], marker_y[keep]))
+        self.marker_length = 0
+        self.drawFinishedMarkers()
+
+    def drawFinishedMarkers(self):
+        """Draws the thinned markers of all finished segments."""
+        self.finished_marker_item.setData(np.concatenate([x for _, _, x, _ in self.finished_markers]),
+            np.concatenate([y for _, _, _, y in self.finished_markers]))
+
+    def updateDetail(self):
+        """Reduces the finished segments and thins their markers again if the zoom changed by more than a factor 2."""
+        if not self.finished:
+            return
+        tolerance = self.pixelTolerance()
+        if self.tolerance / 2 <= tolerance <= self.tolerance * 2:
+            return
+        self.tolerance = tolerance
+        for item, x, y, significance in self.finished:
+            keep = np.flatnonzero(significance > tolerance)
+            item.setData(x[keep], y[keep])
+        spacing = self.markerSpacing()
+        for i, (x, y, _, _) in enumerate(self.finished_markers):
+            keep = thin_points(x, y, spacing)
+            self.finished_markers[i] = (x, y, x[keep], y[keep])
+        self.drawFinishedMarkers()
+
+class RenderScheduler():
+    """
+    Schedules the plot redraws with a single-shot timer restarted after every frame, so frames that
+    cannot keep up are dropped instead of queued. The interval adapts to the measured frame cost, the
+    time spent redrawing plus how late the timer fired, which includes painting the previous frame,
+    so that redrawing takes at most a given share of the GUI thread.
+
+    Every drawn frame is logged with the redraw rate, processing backlog and sample-to-screen latency
+    reported by the redraw function.
+
+    :param redraw: Function that updates the plots, returning (backlog, latency) or None if there was no new data
+    :param min_interval: Shortest interval between redraws in ms (default: 20)
+    :param max_interval: Longest interval between redraws in ms (default: 250)
+    :param load: Maximum share of the GUI thread spent redrawing (default: 0.5)
+    """
+    def __init__(self, redraw, min_interval=20, max_interval=250, load=0.5):
+        self.redraw = redraw
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.load = load
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        """Clears the statistics."""
+        self.interval = self.min_interval
+        self.cost = 0.0 # Smoothed frame cost in ms
+        self.scheduled = None # Time the next tick is due
+        self.start_time = time.perf_counter()
+        self.frame_times = deque() # Times of the frames drawn in the last second
+        self.log = [] # [time s, fps, backlog samples, latency ms, frame ms, interval ms] per drawn frame
+        self.skipped = 0 # Ticks without new data
+        self.dropped = 0 # Intervals missed because a tick fired late
+
+    def start(self):
+        """Starts redrawing."""
+        self.reset()
+        self.running = True
+        self.scheduled = time.perf_counter() + self.interval/1e3
+        self.timer.start(self.interval)
+
+    def stop(self):
+        """Stops redrawing."""
+        self.running = False
+        self.timer.stop()
+
+    def fps(self):
+        """Returns the number of frames drawn in the last second."""
+        return len(self.frame_times)
+
+    def tick(self):
+        """Redraws if there is new data and schedules the next tick."""
+        start = time.perf_counter()
+        late = max(start - self.scheduled, 0.0)
+        self.dropped += int(late*1e3 // self.interval)
+        stats = self.redraw()
+        end = time.perf_counter()
+        if stats is None:
+            self.skipped += 1
+        else:
+            frame = (end - start + late)*1e3
+            self.cost = frame if not self.cost else 0.8*self.cost + 0.2*frame
+            self.interval = int(min(max(self.cost/self.load, self.min_interval), self.max_interval))
+            self.frame_times.append(end)
+            backlog, latency = stats
+            self.log.append([end - self.start_time, self.fps(), backlog, latency*1e3 if latency is not None else float('nan'), frame, self.interval])
+        while self.frame_times and self.frame_times[0] < end - 1.0:
+            self.frame_times.popleft()
+        if self.running:
+            self.scheduled = time.perf_counter() + self.interval/1e3
+            self.timer.start(self.interval)
+
+    def summary(self):
+        """
+        Returns the frame statistics.
+
+        :returns: Dictionary of frame counts and percentiles of the redraw rate, backlog, latency and frame cost
+        """
+        log = np.array(self.log).reshape(-1, 6)
+        summary = {'frames': len(self.log), 'skipped': self.skipped, 'dropped': self.dropped}
+        if len(log):
+            for column, key in ((1, 'fps'), (2, 'backlog'), (3, 'latency_ms'), (4, 'frame_ms')):
+                values = log[~np.isnan(log[:, column]), column]
+                if len(values):
+                    summary[key] = {p: float(np.percentile(values, q)) for p, q in (("p50", 50), ("p95", 95), ("max", 100))}
+        return summary
+
+    def save(self, path):
+        """
+        Writes the statistics and the time series of every drawn frame to a JSON file.
+
+        :param path: Output file path
+        """
+        summary = self.summary()
+        summary['columns'] = ['time_s', 'fps', 'backlog', 'latency_ms', 'frame_ms', 'interval_ms']
+        summary['log'] = [[None if value != value else value for value in row] for row in self.log]
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
 class Worker(QRunnable):
     """
     A worker class to run background tasks in a separate thread.
@@ -58,24 +315,31 @@ class MainWindow(QMainWindow):
     Main application window for controlling data reception and displaying real-time IMU 
     data visualisations.
 
-    :ivar rec: Instance of Receive for collecting and processing data
+    :ivar rec: Instance of Receive for collecting and processing data, or of ProcessReceive in process mode
     :ivar threadpool: Thread pool used to manage and execute background tasks concurrently
-    :ivar update_timer: Idle time for updating the visualisation plots
+    :ivar scheduler: Render scheduler updating the visualisation plots
+    :ivar export_csv: Whether each session is exported to the raw data and estimates CSV files after it ends
+
+    :param process: Runs data collection and processing in a child process
+    :param source: IMU data source, the Xsens device if None
+    :param export_csv: Exports each session to CSV files in a separate worker once it is finalized
     """
-    def __init__(self):
+    # Emitted by the recording worker when a session ends, handled on the GUI thread
+    recording_finished = pyqtSignal()
+
+    def __init__(self, process=False, source=None, export_csv=False):
         super().__init__()
-        self.rec = Receive()
+        self.rec = ProcessReceive(source=source) if process else Receive(source=source)
         self.threadpool = QThreadPool() 
-
-        #self.call_counts = [] # Testing graph updates
-        #self.start_time = int(time.time())
+        self.export_csv = export_csv
 
         self.setFixedSize(QSize(1050, 700))
         self.setWindowTitle("Realtime Foot-mounted INS")
 
         # Updates the plots
-        self.update_timer = QTimer(self)
-        self.update_timer.timeout.connect(self.updateData)
+        self.scheduler = RenderScheduler(self.updateData)
+        self.last_redraw = 0.0
+        self.recording_finished.connect(self.finishRecording)
 
         # UI Layouts
         window1_layout = QHBoxLayout()
@@ -100,6 +364,9 @@ class MainWindow(QMainWindow):
         receive_button2 = QPushButton("Stop Receive")
         receive_button2.clicked.connect(self.stopReceive)
         receive_layout2.addWidget(receive_button2, 0, 1)
+        self.stats_checkbox = QCheckBox("Show render statistics")
+        self.stats_checkbox.toggled.connect(self.toggleStats)
+        receive_layout2.addWidget(self.stats_checkbox, 1, 0)
 
         controls_layout.addLayout(receive_layout1)
         controls_layout.addLayout(receive_layout2)
@@ -119,16 +386,28 @@ class MainWindow(QMainWindow):
         self.line5 = self.plotWidget2.plot([], [], pen=pg.mkPen(color='#ff7f0e', width=2), name='y')
         self.line6 = self.plotWidget2.plot([], [], pen=pg.mkPen(color='#2ca02c', width=2), name='z')
 
+        # Rolling window of the latest scaled raw samples, one contiguous row per plotted line
+        self.raw_window = 250
+        self.raw_scale = np.array([1/9.8]*3 + [1/180/np.pi]*3)
+        self.raw_data = np.zeros((6, self.raw_window))
+        self.raw_indices = np.arange(-self.raw_window, 0, dtype=float)
+        self.raw_count = 0 # Samples added to the window
+        self.raw_lines = [self.line1, self.line2, self.line3, self.line4, self.line5, self.line6]
+
         self.plotWidget3 = CustomPlotWidget(title="Trajectory")
         self.plotWidget3.setLabel('bottom', 'x (m)')
         self.plotWidget3.setLabel('left', 'y (m)')
-        self.scatter_plot = pg.ScatterPlotItem()
-        self.traj_plot = self.plotWidget3.plot([], [], pen=pg.mkPen(color='blue', width=2), name="Trajectory")
+        self.trajectory = TrajectoryPlot(self.plotWidget3, pg.mkPen(color='blue', width=2), pg.mkPen(width=3, color='r'))
         self.scatter_legend_item = self.plotWidget3.plot([], [], pen=pg.mkPen(width=3, color='r'), name="Estimated ZV")
-        self.plotWidget3.addItem(self.scatter_plot)
         self.plotWidget3.enableAutoRange()
         self.plotWidget3.getViewBox().setAspectLocked(True)
 
+        # Render statistics overlay
+        self.stats_label = QLabel(self.plotWidget3)
+        self.stats_label.setStyleSheet("background-color: rgba(255, 255, 255, 200); color: black; padding: 2px;")
+        self.stats_label.move(60, 35)
+        self.stats_label.hide()
+
         # Layout arrangement
         window2_layout = QHBoxLayout()
         window2_layout.addWidget(self.plotWidget1)
@@ -154,64 +433,100 @@ class MainWindow(QMainWindow):
         full_window.setLayout(full_window_layout)
         self.setCentralWidget(full_window)
 
-    def updateRawPlots(self, imudata):
+    def updateRawPlots(self, data, length):
         """
         Update linear acceleration and angular velocity plots with new IMU data.
 
-        :param imudata: Array of accelerometer and gyroscope data
+        :param data: Array of the accelerometer and gyroscope data collected since the last update
+        :param length: Total number of samples collected
         """
         try:
-            data = imudata[-250:]
-            indices = np.arange(len(imudata))[-250:]
-            
-            if data.shape[0] > 0:
-                self.line1.setData(indices, data[:, 0] / 9.8)
-                self.line2.setData(indices, data[:, 1] / 9.8)
-                self.line3.setData(indices, data[:, 2] / 9.8)
-                self.line4.setData(indices, data[:, 3] / 180 / np.pi)
-                self.line5.setData(indices, data[:, 4] / 180 / np.pi)
-                self.line6.setData(indices, data[:, 5] / 180 / np.pi)
+            if length < self.raw_count: # New recording
+                self.raw_data[:] = 0
+                self.raw_indices[:] = np.arange(-self.raw_window, 0)
+                self.raw_count = 0
+            n = data.shape[0]
+            if n == 0:
+                return
+            window = self.raw_window
+            if n < window:
+                # Shifts the window in place by the number of new samples
+                self.raw_data[:, :window-n] = self.raw_data[:, n:]
+            np.multiply(data.T, self.raw_scale[:, None], out=self.raw_data[:, window-n:])
+            self.raw_indices += length - self.raw_count
+            self.raw_count = length
+            filled = min(length, window)
+            for line, row in zip(self.raw_lines, self.raw_data):
+                line.setData(self.raw_indices[window-filled:], row[window-filled:])
         except Exception as e:
             print(f"Error (updateRawPlots): {e}")
 
-    def updatePositionPlot(self, estimates, zv):
+    def updatePositionPlot(self, start, estimates, zv):
         """
-        Update trajectory plot and zero-velocity scatter markers.
+        Update trajectory plot and zero-velocity scatter markers with the new estimates.
 
-        :param estimates: Array of estimated states from the INS
-        :param zv: Zero velocity detection flags
+        :param start: Index of the first new estimate
+        :param estimates: Array of new estimated states from the INS
+        :param zv: Zero velocity detection flags of the new estimates
         """
         try:
-            traj_true = estimates[zv]
-            self.scatter_plot.setData(-traj_true[:, 0], traj_true[:, 1], pen=pg.mkPen(width=3, color='r'), symbol='o', name="Estimated ZV")
-            self.traj_plot.setData(-estimates[:, 0], estimates[:, 1])
+            if start != self.trajectory.count: # New recording
+                self.trajectory.clear()
+                if start != 0: # Missed estimates, redraws all of them
+                    estimates, zv = self.rec.getEstimates()
+            self.trajectory.append(estimates, zv)
         except Exception as e:
             print(f"Error (updatePositionPlot): {e}")
 
+    def updateStats(self, backlog, latency):
+        """
+        Update the render statistics overlay.
+
+        :param backlog: Number of samples waiting to be processed
+        :param latency: Time in seconds from the arrival of the newest processed sample until it was drawn, or None
+        """
+        text = f"FPS: {self.scheduler.fps()}\nBacklog: {backlog} samples"
+        if self.rec.getCatchingUp():
+            text += " (catching up)"
+        if latency is not None:
+            text += f"\nLatency: {latency*1e3:.0f} ms"
+        self.stats_label.setText(text)
+        self.stats_label.adjustSize()
+
+    def toggleStats(self, checked):
+        """Shows or hides the render statistics overlay."""
+        self.stats_label.setVisible(checked)
+
     def updateData(self):
         """
-        Called at regular intervals to update both raw sensor plots and position trajectory.
+        Called by the render scheduler to update both raw sensor plots and position trajectory with new data.
+
+        :returns: Processing backlog in samples and sample-to-screen latency in seconds, or None if there was no new data
         """
         try:
             if self.rec.getRunning():
-                data_list = self.rec.getRawData()
-                estimates, zv = self.rec.getEstimates()
-                if estimates is not None and zv is not None:
-
-                    #current_time = int(time.time()) - self.start_time # Testing graph updates
-                    #while len(self.call_counts) <= current_time:
-                    #    self.call_counts.append(0)
-                    #self.call_counts[current_time] += 1
-
-                    # Make the same size
-                    min_len = min(len(estimates), len(zv))
-                    estimates = estimates[:min_len]
-                    zv = zv[:min_len]
-                    self.updatePositionPlot(estimates, zv)
-                if data_list: # Empty list
-                    self.updateRawPlots(np.array(data_list))
+                # Leaves the interpreter to the processing while it catches up with a backlog
+                if self.rec.getCatchingUp() and time.perf_counter() - self.last_redraw < self.rec.catchup_interval:
+                    return None
+                data, length = self.rec.getRawDataSince(self.raw_count, self.raw_window)
+                start, estimates, zv = self.rec.getNewEstimates()
+                if data.shape[0] == 0 and estimates.shape[0] == 0:
+                    return None
+                self.last_redraw = time.perf_counter()
+                self.updatePositionPlot(start, estimates, zv)
+                if length: # No data yet
+                    self.updateRawPlots(data, length)
+                backlog = self.rec.getBacklog()
+                latency = None
+                estimate_time = self.rec.getEstimateTime()
+                if estimates.shape[0] > 0 and estimate_time is not None:
+                    latency = time.perf_counter() - estimate_time
+                if self.stats_label.isVisible():
+                    self.updateStats(backlog, latency)
+                return backlog, latency
         except Exception as e:
             print(f"Error (updateData): {e}")
+        return None
 
     def startReceive(self):
         """
@@ -227,34 +542,80 @@ class MainWindow(QMainWindow):
                     raise RuntimeError("Invalid trial type (hallway, stairs). Aborting.")
                 if input1 in ['','hallway'] and input2 not in ['', 'walk', 'run', 'mixed']:
                     raise RuntimeError("Invalid trial speed for hallway (walk, run, mixed). Aborting.")
-                rec_main = Worker(self.rec.main, input1, input2, input3)
+                rec_main = Worker(self.recordSession, input1, input2, input3)
                 self.threadpool.start(rec_main)
-                self.update_timer.start(20)
+                self.scheduler.start()
         except Exception as e:
             print(f"Error (startReceive): {e}")
 
+    def recordSession(self, trial_type, trial_speed, file_name):
+        """
+        Records a session with Receive's main method, then starts its CSV export in a separate worker if enabled,
+        so stopping only has to finalize the session files. The session ends when stopped or, for a replay, at
+        the end of the recording, either way the render statistics are saved by finishRecording.
+
+        :param trial_type: Type of trial (hallway or stairs)
+        :param trial_speed: Movement speed (walk, run, or mixed)
+        :param file_name: Output file name
+        """
+        try:
+            self.rec.main(trial_type, trial_speed, file_name)
+        finally:
+            self.recording_finished.emit()
+        if self.export_csv and self.rec.name is not None:
+            self.threadpool.start(Worker(self.exportSession, os.path.join('results','sessions',self.rec.name)))
+
+    def exportSession(self, directory):
+        """
+        Exports a finalized session to the raw data and estimates CSV files.
+
+        :param directory: Session directory
+        """
+        raw_path, estimates_path = export_session(directory)
+        print("Raw data CSV file created at: "+raw_path)
+        print("Estimates CSV file created at: "+estimates_path)
+
     def stopReceive(self):
         """
-        Stops receiving data and stops the update timer.
+        Stops receiving data and the render scheduler. The render statistics are saved once the session has ended.
         """
         try:
             # Only runs if receive is running
             if self.rec.getRunning():
                 self.rec.setStop(True)
-                self.update_timer.stop()
+                self.scheduler.stop()
                 print ("\nStopped running")
-
-                #plt.figure(figsize=(16, 4)) # Testing graph updates
-                #plt.plot(self.call_counts, linestyle='-', color='m')
-                #plt.xlabel('Seconds')
-                #plt.ylabel('Graph Updates')
-                #plt.grid()
-                #plt.savefig('update_rate.png', dpi=400, bbox_inches='tight')   
         except Exception as e:
             print(f"Error (stopReceive): {e}")
 
-# Runs the application
-app = QApplication([])
-window = MainWindow()
-window.show()
-app.exec()
+    def finishRecording(self):
+        """
+        Stops the render scheduler and saves the render statistics when a session has ended, whether it was
+        stopped or a replay reached the end of its recording.
+        """
+        try:
+            self.scheduler.stop()
+            if self.rec.name is not None:
+                path = f"results/estimates/{self.rec.name}_render.json"
+                self.scheduler.save(path)
+                print("Render statistics JSON file created at: "+path)
+        except Exception as e:
+            print(f"Error (finishRecording): {e}")
+
+# Runs the application, guarded since the child process of ProcessReceive imports this module
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Realtime foot-mounted INS.")
+    parser.add_argument("--process", action="store_true", help="Runs data collection and the INS in a child process, sharing the data with the GUI through shared memory")
+    parser.add_argument("--replay", default=None, help="Replays this raw IMU data CSV file instead of recording with the Xsens device")
+    parser.add_argument("--rate", type=int, default=100, help="Output rate of the device, or sampling rate of the replay, in Hz")
+    parser.add_argument("--packet", type=int, default=1, help="Number of samples the replay delivers at a time")
+    parser.add_argument("--export-csv", action="store_true", help="Exports each session to the raw data and estimates CSV files after it ends, otherwise use export_session.py")
+    args = parser.parse_args()
+
+    app = QApplication([])
+    source = ReplaySource(args.replay, args.rate, args.packet) if args.replay else XsensSource(args.rate)
+    window = MainWindow(process=args.process, source=source, export_csv=args.export_csv)
+    if args.process:
+        app.aboutToQuit.connect(window.rec.close)
+    window.show()
+    app.exec()
@@ -1,22 +1,42 @@
 import sys
 import numpy as np
-import xsensdeviceapi as xda
-from threading import Lock
 import os
+import time
+import threading
+import multiprocessing
 from ins_tools.INS_realtime import INS
+from ins_tools.buffers import SampleBuffer, EstimateStore
+from ins_tools.session import SessionWriter, export_session
+from ins_tools.shared import SharedRing
+from ins_tools.batching import BatchController
+from ins_tools.storage import window_size
+from sources import XsCallback, XsensSource
 import tools
 
-class XdaCallback(xda.XsCallback):
+class XdaCallback(XsCallback):
     """
-    Custom callback handler for handling live IMU data from the Xsens device.
+    Custom callback handler for handling live IMU data from the Xsens device or a replay source.
 
-    :ivar m_lock: Thread lock to ensure thread-safe access to the data list
-    :ivar data_list: Accumulated list of IMU data (acceleration and gyroscope)
+    :ivar samples: Growable store of IMU data (acceleration and gyroscope), written directly by the callback
+    :ivar timestamps: Time step in seconds since the previous sample, packet counter, SampleTimeFine and
+        perf_counter() arrival time, for each sample. -1 for a missing packet counter or SampleTimeFine, the
+        time step then is the nominal period.
+    :ivar last_arrival: perf_counter() time the latest sample arrived, None before the first
+    :ivar gaps: (sample index, number of missing packets) for each packet counter gap before a sample
+    :ivar duplicates: Number of packets dropped for repeating the previous packet counter
+
+    :param period: Nominal sampling period in seconds (default: 1/100)
     """
-    def __init__(self):
-        xda.XsCallback.__init__(self)
-        self.m_lock = Lock() # Thread lock
-        self.data_list = [] 
+    def __init__(self, period=1.0/100):
+        XsCallback.__init__(self)
+        self.samples = SampleBuffer(6) # Thread-safe sample store
+        self.timestamps = SampleBuffer(4)
+        self.period = period
+        self.last_counter = None
+        self.last_time_fine = None
+        self.last_arrival = None
+        self.gaps = []
+        self.duplicates = 0
 
     def onLiveDataAvailable(self, dev, packet):
         """
@@ -25,42 +45,121 @@ class XdaCallback(xda.XsCallback):
         :param dev: Device pointer (not used)
         :param packet: IMU data packet containing acceleration and gyroscope data
         """
-        self.m_lock.acquire()
         assert(packet != 0) # Ensure the packet is valid
         acc = packet.calibratedAcceleration()
         gyr = packet.calibratedGyroscopeData()
-        
-        data = list(acc)+list(gyr)
-        self.data_list.append(data) 
-
-        self.m_lock.release()
+        counter = packet.packetCounter() if packet.containsPacketCounter() else -1
+        missing = 0
+        if counter >= 0:
+            if self.last_counter is not None:
+                # The packet counter is 16 bits
+                missing = (counter - self.last_counter - 1) % 2**16
+                if missing == 2**16 - 1: # Same packet again
+                    self.duplicates += 1
+                    return
+                if missing > 0:
+                    self.gaps.append((len(self.samples), missing))
+                    print("Packet counter gap: %d packets missing before sample %d" % (missing, len(self.samples)))
+            self.last_counter = counter
+        # The time step of the sample after a gap spans the missing packets, so the INS integrates over the
+        # time that actually passed
+        dt = self.period*(missing + 1)
+        if packet.containsSampleTimeFine():
+            # SampleTimeFine counts 10 kHz ticks in 32 bits
+            time_fine = packet.sampleTimeFine()
+            if self.last_time_fine is not None:
+                ticks = (time_fine - self.last_time_fine) % 2**32
+                if ticks > 0:
+                    dt = ticks*1e-4
+            self.last_time_fine = time_fine
+        else:
+            time_fine = -1
+
+        # Timestamps first, so every sample read has its timestamp
+        arrival = time.perf_counter()
+        self.timestamps.append([dt, counter, time_fine, arrival])
+        self.samples.append(list(acc)+list(gyr))
+        self.last_arrival = arrival
 
     def getLengthData(self):
-        """Returns the length of the collected data list."""
-        return len(self.data_list)
+        """Returns the number of collected samples."""
+        return len(self.samples)
+
+    def getDataSince(self, i):
+        """Returns a read-only view of the IMU data collected from sample i onwards."""
+        return self.samples.since(i)
+
+    def getLastData(self, n):
+        """Returns a read-only view of the latest n samples of IMU data."""
+        return self.samples.last(n)
+
+    def getTimestampsSince(self, i):
+        """Returns a read-only view of the time steps, packet counters, SampleTimeFine values and arrival times from sample i onwards."""
+        return self.timestamps.since(i)
 
     def getData(self):
-        """Returns the collected IMU data."""
-        return self.data_list
+        """Returns a read-only view of all the collected IMU data."""
+        return self.samples.since(0)
+
+    def waitForData(self, count, timeout):
+        """Blocks until count samples have been collected or the timeout expires, and returns the number collected."""
+        return self.samples.wait(count, timeout)
+
+    def wake(self):
+        """Wakes a thread blocked in waitForData."""
+        self.samples.wake()
 
 class Receive:
     """
-    Manages data collection from the Xsens device and processes it using the INS algorithm.
+    Manages data collection from an IMU source, the Xsens device by default, and processes it using the INS algorithm.
 
     :ivar stop: Boolean to control the data collection loop
     :ivar running: Boolean stating if the main method is running
     :ivar callback: Instance of XdaCallback for handling live IMU data
+    :ivar source: IMU data source, XsensSource or sources.ReplaySource
     :ivar ins: Instance of the INS model used for trajectory estimation
-    :ivar estimates: Array of estimated states from the INS
-    :ivar zv: Zero velocity detection flags
+    :ivar store: Append-only store of the estimated states from the INS and their zero velocity detection flags
+    :ivar min_samples: Minimum number of new samples before making estimates, the initial batch size with target_latency
+    :ivar target_latency: Target time in seconds from the arrival of a sample until its estimate is stored. The batch
+        size is then chosen by a BatchController, None waits for min_samples new samples each time.
+    :ivar batch_samples: Number of new samples the processing loop currently waits for
+    :ivar timeout: Maximum time in seconds the processing loop sleeps without new samples
+    :ivar loop_stats: Wake-up counts and CPU usage of the last processing loop
+    :ivar name: Name of the current session, used for its output files
+    :ivar processed: Number of samples passed on for processing
+    :ivar estimate_time: perf_counter() time the newest processed sample arrived, None before the first estimates
+    :ivar catchup_threshold: Backlog in seconds of samples above which the loop switches to catching up, until
+        the backlog is below half of it again. The GUI then only redraws every catchup_interval seconds, so
+        processing gets most of the interpreter.
+    :ivar catchup_interval: Seconds between GUI redraws while catching up
+    :ivar catching_up: Whether the loop is catching up with a backlog
+    :ivar instrument: Whether the INS records per-stage timing, saved next to the estimates CSV at stop
+    :ivar export_csv: Whether the session is exported to the raw data and estimates CSV files at stop, on the
+        processing thread. It is always recorded incrementally in results/sessions and can be exported later
+        with export_session.py instead.
+    :ivar save_graphs: Whether the trajectory graphs are saved at stop
     """
-    def __init__(self):
+    def __init__(self, min_samples=6, timeout=0.1, instrument=False, export_csv=False, source=None, save_graphs=True, catchup_threshold=0.5, catchup_interval=0.5, target_latency=0.05):
         self.stop = False
         self.running = False
         self.callback = XdaCallback() 
         self.ins = None
-        self.estimates = None
-        self.zv = None
+        self.store = EstimateStore()
+        self.min_samples = min_samples
+        self.target_latency = target_latency
+        self.batch_samples = min_samples
+        self.timeout = timeout
+        self.loop_stats = None
+        self.name = None
+        self.processed = 0
+        self.estimate_time = None
+        self.instrument = instrument
+        self.export_csv = export_csv
+        self.source = source if source is not None else XsensSource()
+        self.save_graphs = save_graphs
+        self.catchup_threshold = catchup_threshold
+        self.catchup_interval = catchup_interval
+        self.catching_up = False
 
     def getStop(self):
         """Returns the current stop state."""
@@ -73,6 +172,8 @@ class Receive:
     def setStop(self, state):
         """Sets the stop state."""
         self.stop = state
+        if state:
+            self.callback.wake() # Stops waiting for new data
 
     def setRunning(self, state):
         """Sets the running state."""
@@ -81,39 +182,75 @@ class Receive:
     def getRawData(self):
         """Returns the raw IMU data collected."""
         return self.callback.getData()
+
+    def getLastRawData(self, n):
+        """Returns the latest n samples of raw IMU data and the total number of samples collected."""
+        length = self.callback.getLengthData()
+        start = max(length - n, 0)
+        # Trimmed to the length read, in case more samples arrived in between
+        return self.callback.getDataSince(start)[:length - start], length
     
+    def getRawDataSince(self, i, n):
+        """Returns at most the latest n samples of raw IMU data from sample i onwards and the total number of samples collected."""
+        length = self.callback.getLengthData()
+        if i > length: # Index from a previous recording
+            i = 0
+        start = max(length - n, i)
+        # Trimmed to the length read, in case more samples arrived in between
+        return self.callback.getDataSince(start)[:length - start], length
+
+    def getBacklog(self):
+        """Returns the number of samples received but not yet estimated."""
+        return self.callback.getLengthData() - len(self.store)
+
+    def getCatchingUp(self):
+        """Returns whether processing is catching up with a backlog."""
+        return self.catching_up
+
+    def getEstimateTime(self):
+        """Returns the perf_counter() time the newest processed sample arrived, or None before the first estimates."""
+        return self.estimate_time
+
     def getEstimates(self):
         """
-        Returns the current INS estimates and zero velocity detections.
+        Returns read-only views of the current INS estimates and zero velocity detections, or None before the first estimates.
+        """
+        if len(self.store) == 0:
+            return None, None
+        return self.store.view()
+
+    def getNewEstimates(self):
+        """
+        Returns the INS estimates and zero velocity detections added since the last call, with the index of the first one.
         """
-        return self.estimates, self.zv
+        return self.store.new_rows()
     
-    def processData(self, imubatch, W, threshold, init):
+    def processData(self, imubatch, W, threshold, flush=False, dt=None):
         """
         Processes a micro-batch of IMU data using zero-velocity detection and INS baseline estimation.
+        Samples that do not complete a detector window are held back by the INS until the next call.
 
-        :param imubatch: Array of IMU micro-batch data
+        :param imubatch: Array of new IMU samples since the previous call, of any size
         :param W: Window size used in the  zero-velocity detector
         :param threshold: Threshold value for the zero-velocity detector
-        :param init: Boolean flag to indicate if it is the initial estimation step
+        :param flush: Boolean flag to also process held back samples, used for the final batch
+        :param dt: Time step in seconds before each sample, from the sensor timestamps
         """
-        zv = self.ins.Localizer.compute_zv_lrt(imudata=imubatch, W=W, G=threshold)
-        estimates = self.ins.baseline(imudata=imubatch, zv=zv, init=init)
+        estimates, zv = self.ins.push(imubatch, W=W, G=threshold, flush=flush, dt=dt)
+        if estimates.shape[0] > 0:
+            self.store.append(estimates, zv)
 
-        self.estimates = estimates if init else np.concatenate((self.estimates, estimates[1:]))
-        self.zv = zv if init else np.concatenate((self.zv, zv[1:]))
-
-    def main(self, trial_type, trial_speed, file_name):
+    @staticmethod
+    def sessionName(trial_type, trial_speed, file_name):
         """
-        Main method to run the data collection, processing, and saving.
+        Applies the default trial type, speed and file name and returns them with the session name.
 
         :param trial_type: Type of trial (hallway or stairs)
         :param trial_speed: Movement speed (walk, run, or mixed)
         :param file_name: Output file name
+
+        :returns: Trial type, trial speed, file name and session name
         """
-        self.setRunning(True)
-        self.callback = XdaCallback() # Resets callback
-        self.ins = None # resets ins
         # Default values
         if not trial_type:
             trial_type = "hallway"
@@ -121,123 +258,165 @@ class Receive:
             trial_speed = "walk"
         if not file_name:
             file_name = "exportfile"
+        if trial_type == 'stairs':
+            trial_speed = 'stairs'
+            trial_type = ''
+            name = '_'.join(['stairs',file_name])
+        else:
+            name = '_'.join([trial_type,trial_speed,file_name])
+        return trial_type, trial_speed, file_name, name
 
-        # Create XsControl object
-        control = xda.XsControl_construct()
-        assert(control != 0)
+    def main(self, trial_type, trial_speed, file_name):
+        """
+        Main method to run the data collection, processing, and saving.
 
-        xda_version = xda.XsVersion()
-        xda.xdaVersion(xda_version)
-        print("Using XDA version %s" % xda_version.toXsString())
+        :param trial_type: Type of trial (hallway or stairs)
+        :param trial_speed: Movement speed (walk, run, or mixed)
+        :param file_name: Output file name
+        """
+        self.setRunning(True)
+        period = 1.0/self.source.rate
+        self.callback = XdaCallback(period) # Resets callback
+        self.ins = None # resets ins
+        self.store = EstimateStore() # resets estimates
+        self.processed = 0
+        self.estimate_time = None
+        self.catching_up = False
+        trial_type, trial_speed, file_name, name = self.sessionName(trial_type, trial_speed, file_name)
+        self.name = name
+        session = None
 
         try:
-            # Scan for connected Xsens devices
-            port_info_array =  xda.XsScanner_scanPorts() 
-            # Find an MTi device
-            mt_port = xda.XsPortInfo()
-            for i in range(port_info_array.size()):
-                if port_info_array[i].deviceId().isMti() or port_info_array[i].deviceId().isMtig():
-                    mt_port = port_info_array[i]
-                    break
-            if mt_port.empty():
-                raise RuntimeError("No MTi device found. Aborting.")
-
-            # Display device details
-            did = mt_port.deviceId()
-            print(" Device ID: %s" % did.toXsString())
-            print(" Port name: %s" % mt_port.portName())
-
-            if not control.openPort(mt_port.portName(), mt_port.baudrate()):
-                raise RuntimeError("Could not open port. Aborting.")
-
-            # Get the device object
-            device = control.device(did)
-            assert(device != 0)
-            print("Device: %s, with ID: %s opened." % (device.productCode(), device.deviceId().toXsString()))
-
-            # Create and attach callback handler to device
-            device.addCallbackHandler(self.callback)
-
-            # Put the device into configuration mode before configuring the device
-            if not device.gotoConfig():
-                raise RuntimeError("Could not put device into configuration mode. Aborting.")
-
-            # Set up the output configuration
-            config_array = xda.XsOutputConfigurationArray()
-            config_array.push_back(xda.XsOutputConfiguration(xda.XDI_PacketCounter, 0))
-            config_array.push_back(xda.XsOutputConfiguration(xda.XDI_SampleTimeFine, 0))
-            # Add IMU configurations
-            config_array.push_back(xda.XsOutputConfiguration(xda.XDI_Acceleration, 100))
-            config_array.push_back(xda.XsOutputConfiguration(xda.XDI_RateOfTurn, 100)) 
-
-            if not device.setOutputConfiguration(config_array):
-                raise RuntimeError("Could not configure the device. Aborting.")
-            if not device.gotoMeasurement():
-                raise RuntimeError("Could not put device into measurement mode. Aborting.")
-            if not device.startRecording(): 
-                raise RuntimeError("Failed to start recording. Aborting.")
-            start_time = xda.XsTimeStamp_nowMs()
-
-            batch_pointer = 0 # keeps track of last processed position
-            W = 5 # window size used by zero velocity detector
-            speed = 5 # min increase in size before making estimates, has to be >= W
+            self.source.open(self.callback)
+            self.source.start()
+            start_time = time.perf_counter()
+
+            # Writes the samples and estimates to disk in the background while recording
+            session = SessionWriter(os.path.join('results','sessions',name), self.callback.samples, self.store, timestamps=self.callback.timestamps, metadata={
+                'raw_path': os.path.join('data',trial_type,trial_speed,file_name+'.csv'),
+                'estimates_path': f"results/estimates/{name}.csv",
+                'rate': self.source.rate,
+            })
+            session.start()
+
+            batch_pointer = 0 # keeps track of last position passed on for processing
+            W = window_size(period) # window size used by zero velocity detector, 50 ms as 5 samples at 100 Hz
             threshold = 2.20E+08 # Threshold for the ZVD
-
-            # Data collection loop
-            while not self.stop:
-                current_data_list = np.array(self.callback.getData())
-                length = len(current_data_list)
+            wakeups = 0 # times the loop woke up
+            timeouts = 0 # wake-ups without enough new samples
+            max_backlog = 0
+            catchup_samples = self.catchup_threshold*self.source.rate
+            catchups = 0 # times the loop fell behind
+            catchup_time = 0.0 # seconds spent catching up
+            self.batch_samples = self.min_samples
+            controller = None
+            if self.target_latency is not None:
+                controller = BatchController(self.source.rate, self.target_latency, initial=self.min_samples)
+            cpu_start = time.thread_time()
+            wall_start = time.perf_counter()
+
+            # Data collection loop, sleeps until enough new samples arrive instead of spinning
+            while not self.stop and not self.source.finished():
                 init = self.ins is None
+                needed = 20 if init else batch_pointer + self.batch_samples
+                length = self.callback.waitForData(needed, self.timeout)
+                wakeups += 1
+                if length < needed:
+                    timeouts += 1
+                    continue
+                backlog = length - len(self.store)
+                max_backlog = max(max_backlog, backlog)
+                if not self.catching_up and backlog > catchup_samples:
+                    self.catching_up = True
+                    catchups += 1
+                    catchup_start = time.perf_counter()
+                    print("Falling behind by %d samples, catching up" % backlog)
+                elif self.catching_up and backlog < catchup_samples/2:
+                    self.catching_up = False
+                    catchup_time += time.perf_counter() - catchup_start
+                    print("Caught up after %.2f s" % (time.perf_counter() - catchup_start))
+                # Arrival time of the newest sample, at most one sample later than the data read below
+                arrival = self.callback.last_arrival
+                # View of the samples not yet passed on for processing, without copying the history
+                new_data = self.callback.getDataSince(batch_pointer)[:length - batch_pointer]
+                dt = self.callback.getTimestampsSince(batch_pointer)[:length - batch_pointer, 0]
                 if init:
-                    if length >= 20:
-                        self.ins = INS(current_data_list[:20], sigma_a = 0.00098, sigma_w = 9.20E-05) # initial ins
-                        self.processData(current_data_list[:20], W, threshold, init)
-                        batch_pointer = 20
+                    self.ins = INS(new_data[:20], sigma_a = 0.00098, sigma_w = 9.20E-05, T = period, cov_history = 'latest', instrument = self.instrument) # initial ins
+                    self.processData(new_data[:20], W, threshold, dt=dt[:20])
+                    batch_pointer = 20
                 else:
-                    if length > batch_pointer+speed: # controls how often make estimates
-                        batch_size = (((length - batch_pointer) // W) * W) - 1 # 5n - 1 to account for last value of previous batch
-                        self.processData(current_data_list[batch_pointer-1:batch_pointer+batch_size], W, threshold, init)
-                        batch_pointer += batch_size
-            
-            # Stop recording data
-            if not device.stopRecording(): 
-                raise RuntimeError("Failed to stop recording. Aborting.")
+                    # Oldest sample without an estimate, including those held back by the detector
+                    oldest = len(self.store)
+                    batch_start = time.perf_counter()
+                    self.processData(new_data, W, threshold, dt=dt)
+                    batch_end = time.perf_counter()
+                    if controller is not None:
+                        latency = batch_end - self.callback.getTimestampsSince(oldest)[0, 3]
+                        self.batch_samples = controller.update(new_data.shape[0], batch_end - batch_start, latency)
+                    batch_pointer = length
+                self.processed = batch_pointer
+                self.estimate_time = arrival
+
+            if self.catching_up:
+                catchup_time += time.perf_counter() - catchup_start
+                self.catching_up = False
+            loop_time = time.perf_counter() - wall_start
+            loop_cpu = time.thread_time() - cpu_start
+            gaps = list(self.callback.gaps)
+            self.loop_stats = {
+                'wakeups': wakeups, 'timeouts': timeouts, 'cpu_time': loop_cpu, 'wall_time': loop_time,
+                'max_backlog': max_backlog, 'catchups': catchups, 'catchup_time': catchup_time,
+                'gaps': len(gaps), 'missing_packets': sum(missing for _, missing in gaps),
+                'duplicate_packets': self.callback.duplicates, 'gap_log': gaps[:1000],
+            }
+            if controller is not None:
+                self.loop_stats['batching'] = controller.summary()
+            print ("Processing loop: %d wake-ups (%d timeouts), CPU time %.2f s (%.1f%% of one core)" % (wakeups, timeouts, loop_cpu, 100*loop_cpu/max(loop_time, 1e-9)))
+            print ("Backlog: at most %d samples, fell behind %d times, %.2f s catching up" % (max_backlog, catchups, catchup_time))
+            print ("Packets: %d gaps with %d missing, %d duplicates dropped" % (len(gaps), self.loop_stats['missing_packets'], self.callback.duplicates))
+            if controller is not None and 'latency_ms' in self.loop_stats['batching']:
+                batching = self.loop_stats['batching']
+                print ("Batching: target latency %.0f ms, achieved p50 %.1f ms, p95 %.1f ms (%.0f%% within target), batch size p50 %.0f, load %.0f%%" % (
+                    batching['target_ms'], batching['latency_ms']['p50'], batching['latency_ms']['p95'], 100*batching['within_target'], batching['batch_size']['p50'], 100*batching['load']))
 
-            device.removeCallbackHandler(self.callback)
-            control.closePort(mt_port.portName())
-            control.close()
+            # Stop recording data
+            self.source.stop()
+            self.source.close()
 
-            runtime = (xda.XsTimeStamp_nowMs() - start_time) / 1000
+            runtime = time.perf_counter() - start_time
             length = self.callback.getLengthData()
             print ("Time: %s seconds" % runtime)
             print ("Datapoints: ", length)
 
-            if trial_type == 'stairs':
-                trial_speed = 'stairs'
-                trial_type = ''
-                name = '_'.join(['stairs',file_name])
-            else:
-                name = '_'.join([trial_type,trial_speed,file_name])
             # Remaining unprocessed data
             if self.ins is not None and batch_pointer != 0:
-                current_data_list = np.array(self.callback.getData())
-                self.processData(current_data_list[batch_pointer-1:], W, threshold, False)
-
-                # Save final trajectory graphs
-                tools.save_topdown(self.estimates, self.zv, file_name, trial_speed, f'results/graphs/{name}_topdown.png')
-                tools.save_vertical(self.estimates, self.zv, file_name, trial_speed, f'results/graphs/{name}_vertical.png')
+                dt = self.callback.getTimestampsSince(batch_pointer)[:length - batch_pointer, 0]
+                self.processData(self.callback.getDataSince(batch_pointer)[:length - batch_pointer], W, threshold, flush=True, dt=dt)
+
+            # Save final trajectory graphs
+            if self.ins is not None and batch_pointer != 0 and self.save_graphs:
+                estimates, zv = self.getEstimates()
+                tools.save_topdown(estimates, zv, file_name, trial_speed, f'results/graphs/{name}_topdown.png')
+                tools.save_vertical(estimates, zv, file_name, trial_speed, f'results/graphs/{name}_vertical.png', T=period)
                 print("Topdown graph image created at: "+f'results/graphs/{name}_topdown.png')   
                 print("Vertical graph image created at: "+f'results/graphs/{name}_vertical.png')   
 
-            # Save raw data        
-            path = os.path.join('data',trial_type,trial_speed,file_name+'.csv')        
-            np.savetxt(path, self.callback.getData(), delimiter=",", header="AccX,AccY,AccZ,GyrX,GyrY,GyrZ", comments='')
-            print("Raw data CSV file created at: "+path)   
+            # Only the last partial chunks are left to write
+            session.finalize(stats=self.loop_stats)
+            session = None
+            print("Session recorded at: "+os.path.join('results','sessions',name))
 
-            # Save position and velocity estimates and stationary detections
-            combined = np.column_stack((self.estimates[:,0:6], self.zv.astype(int)))
-            np.savetxt(f"results/estimates/{name}.csv", combined, delimiter=",", header="x,y,z,vx,vy,vz,zv", comments='', fmt="%.15g,%.15g,%.15g,%.15g,%.15g,%.15g,%d")
-            print("Estimates CSV file created at: "+f"results/estimates/{name}.csv") 
+            # Save raw data, position and velocity estimates and stationary detections
+            if self.export_csv:
+                raw_path, estimates_path = export_session(os.path.join('results','sessions',name))
+                print("Raw data CSV file created at: "+raw_path)
+                print("Estimates CSV file created at: "+estimates_path)
+
+            # Save per-stage timing of the INS
+            if self.ins is not None and self.ins.timer is not None:
+                self.ins.timer.report()
+                self.ins.timer.save(f"results/estimates/{name}_timing.json", loop=self.loop_stats)
+                print("Timing JSON file created at: "+f"results/estimates/{name}_timing.json")
 
             self.setStop(False) # Toggle again since toggle was pressed
         except RuntimeError as error:
@@ -247,4 +426,196 @@ class Receive:
             print(f"Unexpected error: {e}")
             sys.exit(1)
         finally:
+            if session is not None: # Keeps what was recorded before an error, as an incomplete session
+                session.finalize(complete=False)
             self.setRunning(False)  # Ensure running is set to False when the thread ends
+
+class PublishingReceive(Receive):
+    """
+    Receive run in a child process, publishing the processed raw samples, the estimates and the ZUPT
+    flags to shared memory rings read by ProcessReceive in the GUI process. While catching up, they are
+    only published every catchup_interval seconds.
+
+    :param names: Names of the shared rings, from ProcessReceive
+    :param stop_event: Event set by the GUI process to stop recording
+    """
+    def __init__(self, names, stop_event, **kwargs):
+        super().__init__(**kwargs)
+        self.rings = {key: SharedRing(width, capacity, dtype, name=names[key]) for key, (width, capacity, dtype) in ProcessReceive.RINGS.items()}
+        self.raw_processed = 0 # Raw samples passed on for processing
+        self.raw_published = 0
+        self.last_publish = 0.0
+        # Stops the processing loop once the GUI process asks to
+        def watch():
+            stop_event.wait()
+            self.setStop(True)
+        threading.Thread(target=watch, daemon=True).start()
+
+    def processData(self, imubatch, W, threshold, flush=False, dt=None):
+        """Processes a micro-batch as Receive does and publishes it with its new estimates."""
+        arrival = self.callback.last_arrival
+        super().processData(imubatch, W, threshold, flush, dt)
+        self.raw_processed += imubatch.shape[0]
+        if not self.catching_up or time.perf_counter() - self.last_publish >= self.catchup_interval:
+            self.publish()
+        self.rings['status'].append([[self.callback.getLengthData(), arrival if arrival is not None else np.nan, self.catching_up]])
+
+    def publish(self):
+        """Publishes the raw samples and estimates processed since the last call."""
+        self.rings['raw'].append(self.callback.getDataSince(self.raw_published)[:self.raw_processed - self.raw_published])
+        self.raw_published = self.raw_processed
+        published = len(self.rings['zv'])
+        estimates, zv = self.store.view()
+        if estimates.shape[0] > published:
+            self.rings['estimates'].append(estimates[published:])
+            # Written last, readers take its length as the number of complete estimates
+            self.rings['zv'].append(zv[published:])
+        self.last_publish = time.perf_counter()
+
+def receive_process(names, stop_event, trial_type, trial_speed, file_name, **kwargs):
+    """
+    Entry point of the child process of ProcessReceive, records a session with PublishingReceive.
+
+    :param names: Names of the shared rings
+    :param stop_event: Event set to stop recording
+    :param trial_type: Type of trial (hallway or stairs)
+    :param trial_speed: Movement speed (walk, run, or mixed)
+    :param file_name: Output file name
+    :param kwargs: Keyword arguments of Receive
+    """
+    rec = PublishingReceive(names, stop_event, **kwargs)
+    try:
+        rec.main(trial_type, trial_speed, file_name)
+    finally:
+        for ring in rec.rings.values():
+            ring.close()
+
+class ProcessReceive:
+    """
+    Runs data collection and processing in a child process, so the INS does not share the GIL with the
+    GUI, and exposes the same interface as Receive to MainWindow. The raw samples, estimates and ZUPT flags
+    are read from shared memory rings written by the child process, as read-only views without copying.
+    Each session gets new rings, the previous ones are freed when the next session starts.
+
+    :ivar running: Boolean stating if the child process is running
+    :ivar name: Name of the current session, used for its output files
+    :ivar rings: Shared memory rings of the current session
+    :ivar published: Number of estimates already returned by getNewEstimates
+    :ivar kwargs: Keyword arguments of Receive in the child process
+    :ivar catchup_interval: Seconds between GUI redraws while the child process catches up
+    """
+    # Width, capacity and data type of each ring. The status ring holds the number of samples collected,
+    # the arrival time of the newest processed sample and whether processing is catching up.
+    RINGS = {
+        'raw': (6, 65536, np.float64),
+        'estimates': (9, 65536, np.float64),
+        'zv': (1, 65536, np.bool_),
+        'status': (3, 1, np.float64),
+    }
+
+    def __init__(self, **kwargs):
+        self.running = False
+        self.name = None
+        self.rings = None
+        self.published = 0
+        self.kwargs = kwargs
+        self.catchup_interval = kwargs.get('catchup_interval', 0.5)
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+
+    def getRunning(self):
+        """Returns the current running state."""
+        return self.running
+
+    def setStop(self, state):
+        """Asks the child process to stop recording."""
+        if state:
+            self.stop_event.set()
+
+    def getRawDataSince(self, i, n):
+        """Returns at most the latest n samples of raw IMU data from sample i onwards and the total number of samples processed."""
+        ring = self.rings['raw']
+        if i > len(ring): # Index from a previous recording
+            i = 0
+        start, data = ring.since(i, n)
+        return data, start + data.shape[0]
+
+    def getEstimates(self):
+        """Returns read-only views of the latest estimates and zero velocity detections kept in shared memory, or None before the first estimates."""
+        count = len(self.rings['zv'])
+        if count == 0:
+            return None, None
+        start, zv = self.rings['zv'].since(0)
+        estimates = self.rings['estimates'].since(start)[1][:count - start]
+        return estimates, zv[:, 0]
+
+    def getNewEstimates(self):
+        """
+        Returns the INS estimates and zero velocity detections added since the last call, with the index of the first one.
+        """
+        count = len(self.rings['zv'])
+        start, zv = self.rings['zv'].since(self.published)
+        zv = zv[:count - start]
+        estimates = self.rings['estimates'].since(start)[1][:count - start]
+        self.published = count
+        return start, estimates, zv[:, 0]
+
+    def getBacklog(self):
+        """Returns the number of samples received but not yet estimated and published."""
+        status = self.rings['status']
+        if len(status) == 0:
+            return 0
+        collected = status.since(len(status) - 1)[1][0, 0]
+        return max(int(collected) - len(self.rings['zv']), 0)
+
+    def getCatchingUp(self):
+        """Returns whether processing is catching up with a backlog."""
+        status = self.rings['status']
+        return len(status) > 0 and bool(status.since(len(status) - 1)[1][0, 2])
+
+    def getEstimateTime(self):
+        """Returns the perf_counter() time the newest processed sample arrived, or None before the first estimates."""
+        status = self.rings['status']
+        if len(status) == 0:
+            return None
+        arrival = status.since(len(status) - 1)[1][0, 1]
+        return None if np.isnan(arrival) else float(arrival)
+
+    def freeRings(self, rings):
+        """Frees shared memory rings, leaving the mapping to garbage collection if the GUI thread still holds a view."""
+        for ring in rings.values():
+            try:
+                ring.close(unlink=True)
+            except BufferError:
+                pass
+
+    def close(self):
+        """Frees the shared memory rings of the last session."""
+        if self.rings is not None:
+            self.freeRings(self.rings)
+            self.rings = None
+
+    def main(self, trial_type, trial_speed, file_name):
+        """
+        Records a session in a child process and waits until it ends.
+
+        :param trial_type: Type of trial (hallway or stairs)
+        :param trial_speed: Movement speed (walk, run, or mixed)
+        :param file_name: Output file name
+        """
+        try:
+            self.name = Receive.sessionName(trial_type, trial_speed, file_name)[3]
+            previous = self.rings
+            self.rings = {key: SharedRing(width, capacity, dtype) for key, (width, capacity, dtype) in self.RINGS.items()}
+            self.published = 0
+            if previous is not None:
+                self.freeRings(previous)
+            self.stop_event.clear()
+            names = {key: ring.name for key, ring in self.rings.items()}
+            process = self.context.Process(target=receive_process, args=(names, self.stop_event, trial_type, trial_speed, file_name), kwargs=self.kwargs)
+            # Set last, the GUI only reads the rings while running
+            self.running = True
+            process.start()
+            process.join()
+        finally:
+            self.running = False
@@ -1,87 +1,223 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from ins_tools.INS_realtime import INS
+from ins_tools.buffers import EstimateStore
+from ins_tools.storage import load_imu, window_size
 import random
+import argparse
+import resource
+import json
+import time
 
-def processData(ins, win, thresh, imubatch, init): 
+def processData(ins, win, thresh, imubatch, flush=False):
     """
     Processes a micro batch of IMU data using zero-velocity detection and trajectory estimation.
 
     :param ins: INS object used for calculating the state estimates
     :param win: Window size used in the zero-velocity detector
     :param thresh: Threshold value for the zero-velocity detector
-    :param imubatch: Array of IMU micro-batch data
-    :param init: Boolean flag to indicate if it is the initial estimation step
+    :param imubatch: Array of new IMU samples since the previous call, of any size
+    :param flush: Boolean flag to also process held back samples, used for the final batch
 
     :returns:
-        - **x** (*ndarray*) – Estimated position and velocity states
+        - **x** (*ndarray*) – New estimated position and velocity states, empty if no complete window yet
         - **zv** (*ndarray*) – Boolean array indicating zero-velocity points
     :rtype: tuple (ndarray, ndarray)
     """
-    zv = ins.Localizer.compute_zv_lrt(imudata=imubatch, W=win, G=thresh)
-    x = ins.baseline(imudata=imubatch, zv=zv, init=init)
-    return x, zv
-
-thresh = 2.20E+08 
-W = 5
-sig_a = 0.00098
-sig_w = 9.20E-05
-
-# Loads raw IMU data from CSV file
-imu = np.loadtxt('data/hallway/walk/trial1.csv', delimiter=",", skiprows=1)
-print (imu)
-ins = None 
-batch_pointer = 0
-estimates = None
-zv = None
-init = True
-
-while batch_pointer < len(imu):
-    init = ins is None
-    if init: # first 20 datapoints, minimum needed by the Localizer
-        ins = INS(imu[:20], sigma_a = sig_a, sigma_w = sig_w)
-        x, z = processData(ins, W, thresh, imu[:20], init)
-        batch_pointer = 20
-    else:
-        rand = random.randint(5, 20) # substitutes for amount of unprocessed data at the time
-        batch_size = ((rand // W) * W) - 1 # makes sure it is size 5n - 1
-        x, z = processData(ins, W, thresh, imu[batch_pointer-1:batch_pointer+batch_size], init)
-        batch_pointer += batch_size
-    print(batch_pointer)
-    estimates = x if init else np.concatenate((estimates, x[1:]))
-    zv = z if init else np.concatenate((zv, z[1:]))
-
-# First plot (Top-down view)
-fig, axes = plt.subplots(1, 2, figsize=(12, 5))  
-traj_true = estimates[zv] 
-axes[0].scatter(-traj_true[:, 0], traj_true[:, 1], color='red', s=30, label='Estimated ZV')
-axes[0].plot(-estimates[:, 0], estimates[:, 1], linewidth=1.7, color='blue', label='Trajectory')
-
-axes[0].set_title('Top-down graph', fontsize=16, color='black')
-axes[0].set_xlabel('x (m)', fontsize=12)
-axes[0].set_ylabel('y (m)', fontsize=12)
-axes[0].tick_params(labelsize=12)
-axes[0].legend(fontsize=10, numpoints=1)
-axes[0].grid()
-axes[0].axis('square')
-
-# Second plot (Vertical graph)
-num_points = estimates.shape[0]
-time_values = np.arange(0, num_points * 1/100, 1/100)[:num_points]
-axes[1].plot(time_values, estimates[:, 2], linewidth=1, color='blue', label='Trajectory')
-
-time_zv = time_values[zv]
-traj_zv = estimates[zv, 2]
-axes[1].scatter(time_zv, traj_zv, color='red', s=30, label='Estimated ZV')
-
-axes[1].set_title('Vertical graph', fontsize=16, color='black')
-axes[1].set_xlabel('Time (s)', fontsize=12)
-axes[1].set_ylabel('z (m)', fontsize=12)
-axes[1].tick_params(labelsize=12)
-axes[1].legend(fontsize=10, numpoints=1)
-axes[1].grid()
-
-plt.tight_layout()
-#plt.savefig('test.png', dpi=400, bbox_inches='tight')
-plt.show()
+    return ins.push(imubatch, W=win, G=thresh, flush=flush)
 
+def batch_schedule(n, batch_size=None, max_batch=20, seed=0):
+    """
+    Sizes of the micro batches the recording is replayed in. The first batch is the 20 samples needed
+    to initialise the INS, the rest either have a fixed size or a seeded random size, so a replay can be repeated exactly.
+
+    :param n: Number of samples in the recording
+    :param batch_size: Fixed batch size, random sizes if None
+    :param max_batch: Maximum random batch size, substitutes for the amount of unprocessed data at the time
+    :param seed: Seed of the random batch sizes
+
+    :returns: List of batch sizes adding up to n
+    """
+    rng = random.Random(seed)
+    sizes = [min(20, n)]
+    remaining = n - sizes[0]
+    while remaining > 0:
+        size = min(batch_size if batch_size else rng.randint(1, max_batch), remaining)
+        sizes.append(size)
+        remaining -= size
+    return sizes
+
+def parse_pacing(pacing):
+    """
+    Converts a pacing mode to a speed-up over real time.
+
+    :param pacing: "fast" (as fast as possible), "realtime" or "<N>x" (N times real time)
+
+    :returns: Speed-up factor, None for as fast as possible
+    """
+    if pacing == "fast":
+        return None
+    if pacing == "realtime":
+        return 1.0
+    if pacing.endswith("x"):
+        try:
+            speedup = float(pacing[:-1])
+            if speedup > 0:
+                return speedup
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Invalid pacing: {pacing} (fast, realtime or <N>x)")
+
+def replay(imu, sizes, speedup=None, W=5, thresh=2.20E+08, sig_a=0.00098, sig_w=9.20E-05, T=1.0/100, backend="default", instrument=False):
+    """
+    Replays a recording through the streaming INS in micro batches, as Receive does with live data.
+    With pacing, a batch is only processed once its last sample would have arrived from the sensor.
+
+    :param imu: Raw IMU data of the recording, with the time step of each sample as a seventh column if recorded
+    :param sizes: Batch sizes from batch_schedule()
+    :param speedup: Speed-up over real time, None for as fast as possible
+    :param W: Window size used in the zero-velocity detector
+    :param thresh: Threshold value for the zero-velocity detector
+    :param sig_a: Standard deviation of accelerometer noise
+    :param sig_w: Standard deviation of gyroscope noise
+    :param T: Sampling period in seconds, used for pacing recordings without time steps
+    :param backend: Localizer backend
+    :param instrument: Records per-stage timing in the INS
+
+    :returns:
+        - **ins** (*INS*) – INS used for the replay
+        - **store** (*EstimateStore*) – Estimates and zero-velocity detections
+        - **latencies** (*ndarray*) – Processing time of each batch in seconds
+        - **lags** (*ndarray*) – Time from the arrival of the last sample of each batch until its estimates were ready, in seconds
+        - **total** (*float*) – Wall time of the whole replay in seconds
+    :rtype: tuple (INS, EstimateStore, ndarray, ndarray, float)
+    """
+    store = EstimateStore()
+    ins = None
+    latencies = []
+    lags = []
+    batch_pointer = 0
+    # Time each sample arrives after the start of the recording
+    times = np.cumsum(imu[:,6]) if imu.shape[1] > 6 else np.arange(1, len(imu)+1)*T
+    start = time.perf_counter()
+    for i, size in enumerate(sizes):
+        batch = imu[batch_pointer:batch_pointer+size]
+        batch_pointer += size
+        # Time the last sample of the batch arrives
+        arrival = start + times[batch_pointer-1]/speedup if speedup else time.perf_counter()
+        wait = arrival - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        batch_start = time.perf_counter()
+        if ins is None: # first 20 datapoints, minimum needed by the Localizer
+            ins = INS(batch, sigma_a = sig_a, sigma_w = sig_w, T = T, backend = backend, cov_history = 'latest', instrument = instrument)
+        x, z = processData(ins, W, thresh, batch, flush=i == len(sizes)-1)
+        store.append(x, z)
+        end = time.perf_counter()
+        latencies.append(end - batch_start)
+        lags.append(end - arrival)
+    return ins, store, np.array(latencies), np.array(lags), time.perf_counter() - start
+
+def plot_estimates(estimates, zv, T=1.0/100):
+    """
+    Shows the top-down and vertical graphs of the replayed estimates.
+
+    :param estimates: Array of estimated states
+    :param zv: Zero velocity detection flags
+    :param T: Sampling period in seconds
+    """
+    # First plot (Top-down view)
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    traj_true = estimates[zv]
+    axes[0].scatter(-traj_true[:, 0], traj_true[:, 1], color='red', s=30, label='Estimated ZV')
+    axes[0].plot(-estimates[:, 0], estimates[:, 1], linewidth=1.7, color='blue', label='Trajectory')
+
+    axes[0].set_title('Top-down graph', fontsize=16, color='black')
+    axes[0].set_xlabel('x (m)', fontsize=12)
+    axes[0].set_ylabel('y (m)', fontsize=12)
+    axes[0].tick_params(labelsize=12)
+    axes[0].legend(fontsize=10, numpoints=1)
+    axes[0].grid()
+    axes[0].axis('square')
+
+    # Second plot (Vertical graph)
+    num_points = estimates.shape[0]
+    time_values = np.arange(0, num_points * T, T)[:num_points]
+    axes[1].plot(time_values, estimates[:, 2], linewidth=1, color='blue', label='Trajectory')
+
+    time_zv = time_values[zv]
+    traj_zv = estimates[zv, 2]
+    axes[1].scatter(time_zv, traj_zv, color='red', s=30, label='Estimated ZV')
+
+    axes[1].set_title('Vertical graph', fontsize=16, color='black')
+    axes[1].set_xlabel('Time (s)', fontsize=12)
+    axes[1].set_ylabel('z (m)', fontsize=12)
+    axes[1].tick_params(labelsize=12)
+    axes[1].legend(fontsize=10, numpoints=1)
+    axes[1].grid()
+
+    plt.tight_layout()
+    #plt.savefig('test.png', dpi=400, bbox_inches='tight')
+    plt.show()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recording through the real-time pipeline in micro batches and reports its throughput and latency.")
+    parser.add_argument("--file", default="data/hallway/walk/trial1.csv", help="Raw IMU data CSV file to replay")
+    parser.add_argument("--batch-size", type=int, default=None, help="Fixed batch size (default: seeded random sizes)")
+    parser.add_argument("--max-batch", type=int, default=20, help="Maximum random batch size")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random batch sizes")
+    parser.add_argument("--pacing", type=parse_pacing, default="fast", help="fast (as fast as possible), realtime or <N>x (N times real time)")
+    parser.add_argument("--rate", type=float, default=None, help="Sampling rate of the recording in Hz (default: from its recorded time steps, or 100 Hz)")
+    parser.add_argument("--backend", default="default", choices=["default", "fast"], help="Localizer backend")
+    parser.add_argument("--instrument", action="store_true", help="Reports the time spent in each INS processing stage")
+    parser.add_argument("--json", default=None, help="Writes the results to this JSON file")
+    parser.add_argument("--no-plot", action="store_true", help="Skips showing the trajectory graphs")
+    args = parser.parse_args()
+
+    # Loads raw IMU data, from its binary copy if there is one
+    imu, T = load_imu(args.file)
+    if args.rate:
+        T = 1.0/args.rate
+    # Zero-velocity detector window of 50 ms, as in Receive
+    W = window_size(T)
+    sizes = batch_schedule(len(imu), args.batch_size, args.max_batch, args.seed)
+    ins, store, latencies, lags, total = replay(imu, sizes, args.pacing, W=W, T=T, backend=args.backend, instrument=args.instrument)
+    estimates, zv = store.view()
+
+    results = {
+        "file": args.file,
+        "samples": len(imu),
+        "batches": len(sizes),
+        "batch_size": args.batch_size,
+        "max_batch": args.max_batch,
+        "seed": args.seed,
+        "pacing": "fast" if args.pacing is None else f"{args.pacing:g}x",
+        "backend": args.backend,
+        "wall_time_s": total,
+        "processing_time_s": float(latencies.sum()),
+        # Throughput of the processing alone, independent of the pacing
+        "samples_per_s": len(imu)/latencies.sum(),
+        "realtime_factor": len(imu)*T/latencies.sum(),
+        "latency_ms": {p: float(np.percentile(latencies, q)*1e3) for p, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+        "lag_ms": {p: float(np.percentile(lags, q)*1e3) for p, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+        # ru_maxrss is in kB on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+    }
+    print(f"{results['samples']} samples in {results['batches']} batches, pacing {results['pacing']}")
+    print(f"Throughput: {results['samples_per_s']:.0f} samples/s ({results['realtime_factor']:.1f}x real time)")
+    print("Batch latency: " + ", ".join(f"{p} {v:.2f} ms" for p, v in results['latency_ms'].items()))
+    print("Lag behind sensor: " + ", ".join(f"{p} {v:.2f} ms" for p, v in results['lag_ms'].items()))
+    print(f"Peak memory: {results['peak_memory_mb']:.1f} MB")
+    if ins.timer is not None:
+        ins.timer.report()
+        results["stages"] = ins.timer.summary()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written to: " + args.json)
+
+    if not args.no_plot:
+        plot_estimates(estimates, zv, T)
+
+if __name__ == "__main__":
+    main()
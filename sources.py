@@ -0,0 +1,202 @@
+import numpy as np
+import threading
+import time
+from ins_tools.storage import load_table
+try:
+    import xsensdeviceapi as xda
+except ImportError: # Only needed to record with an Xsens device
+    xda = None
+
+# Base class of the data callbacks. The replay source calls them the same way, without the Xsens API.
+XsCallback = xda.XsCallback if xda is not None else object
+
+class XsensSource:
+    """
+    IMU data from an Xsens MTi device, delivered to the callback by the Xsens device API.
+
+    :param rate: Output rate of the acceleration and rate of turn in Hz, one the device supports (default: 100)
+    """
+    def __init__(self, rate=100):
+        self.rate = rate
+        self.control = None
+        self.device = None
+        self.port = None
+        self.callback = None
+
+    def open(self, callback):
+        """
+        Finds and configures the first MTi device and attaches the callback to it.
+
+        :param callback: XdaCallback receiving the data packets
+        """
+        if xda is None:
+            raise RuntimeError("The Xsens device API (xsensdeviceapi) is not installed. Aborting.")
+        # Create XsControl object
+        self.control = xda.XsControl_construct()
+        assert(self.control != 0)
+
+        xda_version = xda.XsVersion()
+        xda.xdaVersion(xda_version)
+        print("Using XDA version %s" % xda_version.toXsString())
+
+        # Scan for connected Xsens devices
+        port_info_array =  xda.XsScanner_scanPorts()
+        # Find an MTi device
+        mt_port = xda.XsPortInfo()
+        for i in range(port_info_array.size()):
+            if port_info_array[i].deviceId().isMti() or port_info_array[i].deviceId().isMtig():
+                mt_port = port_info_array[i]
+                break
+        if mt_port.empty():
+            raise RuntimeError("No MTi device found. Aborting.")
+
+        # Display device details
+        did = mt_port.deviceId()
+        print(" Device ID: %s" % did.toXsString())
+        print(" Port name: %s" % mt_port.portName())
+
+        if not self.control.openPort(mt_port.portName(), mt_port.baudrate()):
+            raise RuntimeError("Could not open port. Aborting.")
+        self.port = mt_port
+
+        # Get the device object
+        self.device = self.control.device(did)
+        assert(self.device != 0)
+        print("Device: %s, with ID: %s opened." % (self.device.productCode(), self.device.deviceId().toXsString()))
+
+        # Create and attach callback handler to device
+        self.callback = callback
+        self.device.addCallbackHandler(callback)
+
+        # Put the device into configuration mode before configuring the device
+        if not self.device.gotoConfig():
+            raise RuntimeError("Could not put device into configuration mode. Aborting.")
+
+        # Set up the output configuration
+        config_array = xda.XsOutputConfigurationArray()
+        config_array.push_back(xda.XsOutputConfiguration(xda.XDI_PacketCounter, 0))
+        config_array.push_back(xda.XsOutputConfiguration(xda.XDI_SampleTimeFine, 0))
+        # Add IMU configurations
+        config_array.push_back(xda.XsOutputConfiguration(xda.XDI_Acceleration, int(self.rate)))
+        config_array.push_back(xda.XsOutputConfiguration(xda.XDI_RateOfTurn, int(self.rate)))
+
+        if not self.device.setOutputConfiguration(config_array):
+            raise RuntimeError("Could not configure the device for %g Hz. Aborting." % self.rate)
+
+    def start(self):
+        """Starts measuring and recording."""
+        if not self.device.gotoMeasurement():
+            raise RuntimeError("Could not put device into measurement mode. Aborting.")
+        if not self.device.startRecording():
+            raise RuntimeError("Failed to start recording. Aborting.")
+
+    def stop(self):
+        """Stops recording."""
+        if not self.device.stopRecording():
+            raise RuntimeError("Failed to stop recording. Aborting.")
+
+    def close(self):
+        """Detaches the callback and closes the device."""
+        self.device.removeCallbackHandler(self.callback)
+        self.control.closePort(self.port.portName())
+        self.control.close()
+
+    def finished(self):
+        """A device streams until stopped."""
+        return False
+
+class ReplayPacket:
+    """
+    Data packet of a replayed sample, with the methods of the Xsens data packet used by the callback.
+
+    :param row: Accelerometer and gyroscope values of the sample
+    :param counter: Packet counter, 16 bits
+    :param time_fine: SampleTimeFine, 10 kHz ticks in 32 bits
+    """
+    def __init__(self, row, counter, time_fine):
+        self.row = row
+        self.counter = counter
+        self.time_fine = time_fine
+
+    def calibratedAcceleration(self):
+        return self.row[0:3]
+
+    def calibratedGyroscopeData(self):
+        return self.row[3:6]
+
+    def containsPacketCounter(self):
+        return True
+
+    def packetCounter(self):
+        return self.counter
+
+    def containsSampleTimeFine(self):
+        return True
+
+    def sampleTimeFine(self):
+        return self.time_fine
+
+class ReplaySource:
+    """
+    Replays a raw IMU data recording through the same callback path as a device, from a background thread,
+    so the live pipeline can be run and load tested without the hardware. The samples are delivered in
+    packets of a fixed number of samples on a fixed schedule; if the receiving side falls behind, the
+    packets are delivered back to back until the schedule is caught up.
+
+    :param path: Raw IMU data CSV file, loaded from its binary copy if there is one
+    :param rate: Sampling rate in Hz (default: 100)
+    :param packet: Number of samples delivered at a time (default: 1)
+    """
+    def __init__(self, path, rate=100, packet=1):
+        self.path = path
+        self.rate = rate
+        self.packet = packet
+        self.thread = None
+        self.stopping = None
+        self.done = None
+
+    def open(self, callback):
+        """
+        Loads the recording.
+
+        :param callback: XdaCallback receiving the data packets
+        """
+        self.callback = callback
+        self.data = np.asarray(load_table(self.path), dtype=float)
+        # Created here so the source can be passed to a child process before it is opened
+        self.stopping = threading.Event()
+        self.done = threading.Event()
+        print("Replaying %s: %d samples at %g Hz in packets of %d" % (self.path, len(self.data), self.rate, self.packet))
+
+    def run(self):
+        """Delivers the samples until the recording ends or the source is stopped."""
+        start = time.perf_counter()
+        for i in range(0, len(self.data), self.packet):
+            wait = start + i/self.rate - time.perf_counter()
+            if wait > 0 and self.stopping.wait(wait):
+                break
+            if self.stopping.is_set():
+                break
+            for j, row in enumerate(self.data[i:i+self.packet], i):
+                self.callback.onLiveDataAvailable(None, ReplayPacket(row, j % 2**16, round(j*1e4/self.rate) % 2**32))
+        self.done.set()
+        self.callback.wake() # Ends the processing loop without waiting for its timeout
+
+    def start(self):
+        """Starts replaying."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops replaying."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        """Releases the recording."""
+        self.data = None
+
+    def finished(self):
+        """Returns whether the whole recording was delivered."""
+        return self.done is not None and self.done.is_set()
@@ -62,3 +62,61 @@ def save_vertical(traj, zv, name, speed, save_dir, T=1.0/100):
     plt.legend(fontsize=10, numpoints=1)
     plt.grid()
     plt.savefig(save_dir, dpi=400, bbox_inches='tight')       
+
+def path_significance(x, y):
+    """
+    Douglas-Peucker significance of every point of a 2D path: the largest tolerance at which the
+    reduction still keeps the point. Computed once, the path can then be reduced to any tolerance with
+    significance > tolerance, which gives the same points as running Douglas-Peucker with that tolerance.
+    Used to draw long trajectories at the level of detail of the view.
+
+    :param x: Array of x coordinates
+    :param y: Array of y coordinates
+
+    :returns: Array of significances, infinite for the first and last points
+    """
+    n = len(x)
+    significance = np.zeros(n)
+    significance[0] = significance[-1] = np.inf
+    # (first, last, significance of the split that created the range)
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first+1:last] - x[first]
+        py = y[first+1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px, py)
+        else:
+            # Distance from the chord through the first and last points
+            dist = np.abs(px*dy - py*dx)/length
+        i = int(np.argmax(dist))
+        mid = first + 1 + i
+        # A point is only reached if the splits before it are kept too
+        significance[mid] = min(dist[i], parent)
+        stack.append((first, mid, significance[mid]))
+        stack.append((mid, last, significance[mid]))
+    return significance
+
+def thin_points(x, y, spacing):
+    """
+    Thins a sequence of 2D points to those at least spacing from the previously kept point, starting
+    with the first. Used to draw the zero-velocity markers of long trajectories without overlapping.
+
+    :param x: Array of x coordinates
+    :param y: Array of y coordinates
+    :param spacing: Minimum distance between consecutive kept points
+
+    :returns: Array of the indices of the kept points
+    """
+    keep = []
+    last_x = last_y = None
+    for i in range(len(x)):
+        if last_x is None or np.hypot(x[i] - last_x, y[i] - last_y) >= spacing:
+            keep.append(i)
+            last_x, last_y = x[i], y[i]
+    return np.array(keep, dtype=int)
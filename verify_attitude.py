@@ -0,0 +1,61 @@
+import numpy as np
+import os
+import argparse
+from ins_tools.INS_realtime import INS
+from ins_tools.storage import load_imu, window_size
+
+def attitude_difference(q1, q2):
+    """
+    Angle of the rotation between two sets of attitude quaternions.
+
+    :param q1: Array of unit quaternions
+    :param q2: Array of unit quaternions
+
+    :returns: Array of angles in radians
+    """
+    # q and -q are the same rotation
+    dot = np.abs(np.sum(q1 * q2, axis=1))
+    return 2 * np.arccos(np.clip(dot, 0, 1))
+
+def run_trial(imu, T, attitude_correction, backend):
+    """
+    Runs the INS over a whole recording with the given attitude correction method.
+
+    :param imu: Raw IMU data of the recording, with the time step of each sample as a seventh column if recorded
+    :param T: Sampling period in seconds
+    :param attitude_correction: Attitude correction method ("quaternion" or "matrix")
+    :param backend: Localizer backend
+
+    :returns:
+        - **x** (*ndarray*) – Array of estimated states from the INS
+        - **q** (*ndarray*) – Array of estimated quaternions
+    :rtype: tuple (ndarray, ndarray)
+    """
+    ins = INS(imu, sigma_a = 0.00098, sigma_w = 9.20E-05, T=T, backend=backend, attitude_correction=attitude_correction, cov_history='latest')
+    zv = ins.Localizer.compute_zv_lrt(imu, W=window_size(T), G=2.20E+08)
+    x = ins.baseline(imudata=imu, zv=zv, init=True)
+    return x, ins.q.copy()
+
+# Compares the quaternion attitude correction in the ZUPT corrector with the original rotation matrix
+# and eigendecomposition method over every recorded trial
+parser = argparse.ArgumentParser(description="Reports the attitude difference between the quaternion and rotation matrix ZUPT attitude corrections.")
+parser.add_argument("--backend", default="fast", choices=["default", "fast"], help="Localizer backend used for both runs")
+args = parser.parse_args()
+
+max_att = 0
+max_pos = 0
+for root, _, files in sorted(os.walk('data')):
+    for filename in sorted(files):
+        if ('trial' in filename) and filename.endswith(".csv"):
+            file_path = os.path.join(root, filename)
+            imu, T = load_imu(file_path)
+            x_mat, q_mat = run_trial(imu, T, "matrix", args.backend)
+            x_quat, q_quat = run_trial(imu, T, "quaternion", args.backend)
+            att = np.max(attitude_difference(q_mat, q_quat))
+            pos = np.max(np.linalg.norm(x_mat[:, :3] - x_quat[:, :3], axis=1))
+            max_att = max(max_att, att)
+            max_pos = max(max_pos, pos)
+            print(f"File: {file_path}, max attitude difference: {np.degrees(att):.3e} deg, max position difference: {pos:.3e} m")
+
+print(f"Max attitude difference over all trials: {np.degrees(max_att):.3e} deg")
+print(f"Max position difference over all trials: {max_pos:.3e} m")